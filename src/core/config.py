@@ -2,7 +2,7 @@
 import os
 from typing import Optional
 from pydantic_settings import BaseSettings
-from pydantic import Field, field_validator, ConfigDict
+from pydantic import Field, field_validator, model_validator, ConfigDict
 
 
 class Settings(BaseSettings):
@@ -18,6 +18,8 @@ class Settings(BaseSettings):
     # API Keys (required)
     openrouter_api_key: str = Field(..., validation_alias="OPENROUTER_API_KEY")
     internal_api_key: str = Field(..., validation_alias="INTERNAL_API_KEY")
+    # Admin endpoints (profiling) are disabled unless this is set
+    admin_api_key: Optional[str] = Field(default=None, validation_alias="ADMIN_API_KEY")
     
     # API Configuration
     api_url: str = Field(
@@ -29,7 +31,34 @@ class Settings(BaseSettings):
     model_name: str = Field(default="deepseek/deepseek-chat", validation_alias="MODEL_NAME")
     model_temperature: float = Field(default=0.2, validation_alias="MODEL_TEMPERATURE", ge=0.0, le=2.0)
     model_max_tokens: int = Field(default=2000, validation_alias="MODEL_MAX_TOKENS", gt=0)
+    model_context_tokens: int = Field(default=65536, validation_alias="MODEL_CONTEXT_TOKENS", gt=0)
+
+    # Prompt assembly (prompt budget excludes the completion's MODEL_MAX_TOKENS)
+    prompt_token_budget: int = Field(default=8000, validation_alias="PROMPT_TOKEN_BUDGET", gt=0)
+    rag_context_share: float = Field(default=0.5, validation_alias="RAG_CONTEXT_SHARE", ge=0.0, le=1.0)
     
+    # Resumable SSE streams
+    stream_replay_max_events: int = Field(default=1024, validation_alias="STREAM_REPLAY_MAX_EVENTS", gt=0)
+    stream_replay_max_bytes: int = Field(default=16 * 1024 * 1024, validation_alias="STREAM_REPLAY_MAX_BYTES", gt=0)
+    stream_resume_grace_seconds: float = Field(default=30.0, validation_alias="STREAM_RESUME_GRACE_SECONDS", ge=0.0)
+
+    # Retrieval
+    rag_cache_size: int = Field(default=1024, validation_alias="RAG_CACHE_SIZE", ge=0)
+    rag_batch_max_wait_ms: float = Field(default=2.0, validation_alias="RAG_BATCH_MAX_WAIT_MS", ge=0.0)
+    rag_batch_max_size: int = Field(default=32, validation_alias="RAG_BATCH_MAX_SIZE", gt=0)
+    # Empty disables near-duplicate collapsing
+    rag_near_duplicate_bits: Optional[int] = Field(default=10, validation_alias="RAG_NEAR_DUPLICATE_BITS", ge=0, le=64)
+    rag_mmr_lambda: Optional[float] = Field(default=None, validation_alias="RAG_MMR_LAMBDA", ge=0.0, le=1.0)
+
+    # Live ingestion
+    ingest_queue_size: int = Field(default=64, validation_alias="INGEST_QUEUE_SIZE", gt=0)
+    ingest_max_upload_bytes: int = Field(default=10 * 1024 * 1024, validation_alias="INGEST_MAX_UPLOAD_BYTES", gt=0)
+
+    # Session snapshots (disabled unless a directory is set)
+    session_snapshot_dir: Optional[str] = Field(default=None, validation_alias="SESSION_SNAPSHOT_DIR")
+    session_snapshot_interval_seconds: float = Field(default=5.0, validation_alias="SESSION_SNAPSHOT_INTERVAL_SECONDS", gt=0.0)
+    session_snapshot_buckets: int = Field(default=64, validation_alias="SESSION_SNAPSHOT_BUCKETS", gt=0)
+
     # Logging
     log_level: str = Field(default="INFO", validation_alias="LOG_LEVEL")
     
@@ -39,6 +68,14 @@ class Settings(BaseSettings):
         validation_alias="CORS_ORIGINS"
     )
     
+    @field_validator("rag_near_duplicate_bits", "rag_mmr_lambda", mode="before")
+    @classmethod
+    def empty_as_none(cls, v):
+        """Treat an empty environment value as unset (feature off)."""
+        if isinstance(v, str) and not v.strip():
+            return None
+        return v
+
     @field_validator("log_level")
     @classmethod
     def validate_log_level(cls, v: str) -> str:
@@ -49,6 +86,15 @@ class Settings(BaseSettings):
             raise ValueError(f"LOG_LEVEL must be one of {valid_levels}")
         return v_upper
 
+    @model_validator(mode="after")
+    def validate_context_budget(self) -> "Settings":
+        """Prompt and completion must fit the model's context window."""
+        if self.prompt_token_budget + self.model_max_tokens > self.model_context_tokens:
+            raise ValueError(
+                "PROMPT_TOKEN_BUDGET + MODEL_MAX_TOKENS must not exceed MODEL_CONTEXT_TOKENS"
+            )
+        return self
+
 
 # Global settings instance
 _settings: Optional[Settings] = None
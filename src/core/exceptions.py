@@ -33,3 +33,8 @@ class AuthenticationError(AIAgentException):
 class ValidationError(AIAgentException):
     """Raised when input validation fails."""
     pass
+
+
+class IngestionError(AIAgentException):
+    """Raised when documents cannot be accepted for ingestion."""
+    pass
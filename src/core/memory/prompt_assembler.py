@@ -0,0 +1,207 @@
+"""
+Token-budgeted prompt assembly.
+
+Turns the current user message, session history and retrieved documents into
+the message list sent upstream:
+
+- Exact duplicates are dropped: repeated documents, consecutive repeats in
+  history, and the history copy of the current user message.
+- Retrieved documents are merged into a single system block.
+- Everything is packed into a token budget by priority. The user message
+  always goes in. Documents (best first) may take up to ``context_share`` of
+  what is left; history then fills the remainder newest-first, stopping at
+  the first turn that does not fit so no gaps open in the conversation; any
+  budget history leaves over is offered back to documents skipped earlier.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence, Tuple
+
+from src.core.memory.token_budget import estimate_tokens
+
+CONTEXT_HEADER = "Context:\n"
+DOC_SEPARATOR = "\n\n---\n\n"
+
+
+@dataclass
+class AssemblyStats:
+    budget: int
+    tokens: Dict[str, int] = field(default_factory=dict)
+    docs_used: int = 0
+    docs_dropped: int = 0
+    history_used: int = 0
+    history_dropped: int = 0
+    duplicates_removed: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.tokens.values())
+
+    def to_dict(self) -> Dict:
+        return {
+            "budget": self.budget,
+            "total_tokens": self.total_tokens,
+            "tokens": dict(self.tokens),
+            "docs_used": self.docs_used,
+            "docs_dropped": self.docs_dropped,
+            "history_used": self.history_used,
+            "history_dropped": self.history_dropped,
+            "duplicates_removed": self.duplicates_removed,
+        }
+
+
+class PromptAssembler:
+    """
+    Builds upstream prompts within ``budget`` estimated tokens.
+
+    Args:
+        budget: Prompt token budget (completion tokens excluded)
+        context_share: Fraction of the budget left after the user message
+            that retrieved documents may claim before history is packed
+    """
+
+    def __init__(self, budget: int, context_share: float = 0.5):
+        self.budget = budget
+        self.context_share = context_share
+        self.requests = 0
+        self.tokens_sent = 0
+        self.tokens_dropped = 0
+        self.duplicates_removed = 0
+
+    def assemble(
+        self,
+        user_message: str,
+        history: Sequence[Dict[str, str]],
+        docs: Sequence[str],
+    ) -> Tuple[List[Dict[str, str]], AssemblyStats]:
+        """
+        Args:
+            user_message: The current turn
+            history: Session messages, oldest first; may already end with
+                ``user_message``
+            docs: Retrieved document texts, best first
+
+        Returns:
+            ``(messages, stats)``
+        """
+        stats = AssemblyStats(budget=self.budget)
+        history, removed_history = _dedupe_history(history, user_message)
+        docs, removed_docs = _dedupe_docs(docs)
+        stats.duplicates_removed = removed_history + removed_docs
+
+        user_tokens = estimate_tokens(user_message)
+        remaining = self.budget - user_tokens
+
+        # Documents first, up to their share of the budget
+        doc_costs = [estimate_tokens(doc) + estimate_tokens(DOC_SEPARATOR) for doc in docs]
+        header_cost = estimate_tokens(CONTEXT_HEADER)
+        chosen = [False] * len(docs)
+        context_tokens = self._pack_docs(
+            doc_costs, chosen, int(max(remaining, 0) * self.context_share), header_cost, 0
+        )
+        remaining -= context_tokens
+
+        # History newest-first, contiguous
+        kept: List[Dict[str, str]] = []
+        history_tokens = 0
+        for message in reversed(history):
+            cost = estimate_tokens(message["content"])
+            if cost > remaining - history_tokens:
+                break
+            kept.append(message)
+            history_tokens += cost
+        kept.reverse()
+        remaining -= history_tokens
+
+        # Leftover budget goes back to documents that did not fit earlier
+        context_tokens += self._pack_docs(
+            doc_costs, chosen, remaining, header_cost, context_tokens
+        )
+
+        used_docs = [doc for doc, keep in zip(docs, chosen) if keep]
+        messages: List[Dict[str, str]] = []
+        if used_docs:
+            messages.append(
+                {"role": "system", "content": CONTEXT_HEADER + DOC_SEPARATOR.join(used_docs)}
+            )
+        messages.extend(kept)
+        messages.append({"role": "user", "content": user_message})
+
+        stats.tokens = {"context": context_tokens, "history": history_tokens, "user": user_tokens}
+        stats.docs_used = len(used_docs)
+        stats.docs_dropped = len(docs) - len(used_docs)
+        stats.history_used = len(kept)
+        stats.history_dropped = len(history) - len(kept)
+        self._record(stats, doc_costs, chosen, history[: len(history) - len(kept)])
+        return messages, stats
+
+    def stats(self) -> Dict:
+        return {
+            "budget": self.budget,
+            "requests": self.requests,
+            "tokens_sent": self.tokens_sent,
+            "tokens_dropped": self.tokens_dropped,
+            "duplicates_removed": self.duplicates_removed,
+        }
+
+    @staticmethod
+    def _pack_docs(
+        costs: List[int],
+        chosen: List[bool],
+        allowance: int,
+        header_cost: int,
+        already_used: int,
+    ) -> int:
+        # Greedy in rank order; a document that does not fit is skipped so
+        # smaller, lower-ranked ones can still use the space
+        used = 0
+        for i, cost in enumerate(costs):
+            if chosen[i]:
+                continue
+            extra = cost + (header_cost if not already_used and not used else 0)
+            if extra <= allowance - used:
+                chosen[i] = True
+                used += extra
+        return used
+
+    def _record(
+        self,
+        stats: AssemblyStats,
+        doc_costs: List[int],
+        chosen: List[bool],
+        dropped_history: Sequence[Dict[str, str]],
+    ) -> None:
+        self.requests += 1
+        self.tokens_sent += stats.total_tokens
+        self.tokens_dropped += sum(cost for cost, keep in zip(doc_costs, chosen) if not keep)
+        self.tokens_dropped += sum(estimate_tokens(m["content"]) for m in dropped_history)
+        self.duplicates_removed += stats.duplicates_removed
+
+
+def _dedupe_history(
+    history: Sequence[Dict[str, str]], user_message: str
+) -> Tuple[List[Dict[str, str]], int]:
+    messages = list(history)
+    removed = 0
+    # The current turn is usually stored before the prompt is built
+    if messages and messages[-1] == {"role": "user", "content": user_message}:
+        messages.pop()
+        removed += 1
+    out: List[Dict[str, str]] = []
+    for message in messages:
+        if out and out[-1] == message:
+            removed += 1
+            continue
+        out.append(message)
+    return out, removed
+
+
+def _dedupe_docs(docs: Sequence[str]) -> Tuple[List[str], int]:
+    seen = set()
+    out: List[str] = []
+    for doc in docs:
+        key = " ".join(doc.split())
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append(doc)
+    return out, len(docs) - len(out)
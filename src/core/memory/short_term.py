@@ -2,10 +2,17 @@ class ShortTermMemory:
     def __init__(self, max_messages: int = 10):
         self.max_messages = max_messages
         self.messages = []
+        # Bumped on every change; lets snapshots write only dirty sessions
+        self.version = 0
 
     def add(self, role: str, content: str):
         self.messages.append({"role": role, "content": content})
         self.messages = self.messages[-self.max_messages :]
+        self.version += 1
+
+    def restore(self, messages):
+        """Load previously snapshotted messages without marking them dirty."""
+        self.messages = list(messages)[-self.max_messages :]
 
     def get(self):
         """Return the internal messages list directly."""
@@ -0,0 +1,317 @@
+"""
+Persistent session snapshots for warm restarts.
+
+Sessions are hashed into a fixed number of buckets. Each bucket is an
+append-only segment file of length-prefixed, CRC-checked binary records;
+the newest record for a session wins. Nothing is read at startup: a
+bucket's offset index is built the first time one of its sessions is
+requested or written, so restart time does not depend on how many sessions
+exist.
+Buckets whose files grow well beyond their live data are compacted by
+rewriting the live records into a fresh segment and atomically swapping it
+in.
+
+Record layout (little endian)::
+
+    u32 payload_len | u32 crc32(payload) | payload
+    payload = u16 sid_len | sid | u16 n_messages | message*
+    message = u8 role_code [| u8 role_len | role] | u32 content_len | content
+"""
+import asyncio
+import os
+import struct
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.core.logger import get_logger
+
+logger = get_logger()
+
+HEADER = struct.Struct("<II")
+ROLE_CODES = {"system": 0, "user": 1, "assistant": 2}
+ROLE_NAMES = {code: role for role, code in ROLE_CODES.items()}
+CUSTOM_ROLE = 255
+MAX_SESSION_ID_BYTES = 0xFFFF
+MAX_MESSAGES = 0xFFFF
+MAX_ROLE_BYTES = 0xFF
+
+
+def encode_session(session_id: str, messages: List[Dict[str, str]]) -> bytes:
+    """
+    Raises:
+        ValueError: A field does not fit its length prefix (or is not
+            encodable as UTF-8)
+    """
+    sid = session_id.encode("utf-8")
+    if len(sid) > MAX_SESSION_ID_BYTES:
+        raise ValueError(f"Session id is {len(sid)} bytes (max {MAX_SESSION_ID_BYTES})")
+    if len(messages) > MAX_MESSAGES:
+        raise ValueError(f"Session has {len(messages)} messages (max {MAX_MESSAGES})")
+    parts = [struct.pack("<H", len(sid)), sid, struct.pack("<H", len(messages))]
+    for message in messages:
+        code = ROLE_CODES.get(message["role"], CUSTOM_ROLE)
+        parts.append(struct.pack("<B", code))
+        if code == CUSTOM_ROLE:
+            role = message["role"].encode("utf-8")
+            if len(role) > MAX_ROLE_BYTES:
+                raise ValueError(f"Role is {len(role)} bytes (max {MAX_ROLE_BYTES})")
+            parts.append(struct.pack("<B", len(role)) + role)
+        content = message["content"].encode("utf-8")
+        parts.append(struct.pack("<I", len(content)))
+        parts.append(content)
+    return b"".join(parts)
+
+
+def decode_session(payload: bytes) -> Tuple[str, List[Dict[str, str]]]:
+    (sid_len,) = struct.unpack_from("<H", payload, 0)
+    pos = 2
+    session_id = payload[pos : pos + sid_len].decode("utf-8")
+    pos += sid_len
+    (count,) = struct.unpack_from("<H", payload, pos)
+    pos += 2
+    messages = []
+    for _ in range(count):
+        code = payload[pos]
+        pos += 1
+        if code == CUSTOM_ROLE:
+            role_len = payload[pos]
+            role = payload[pos + 1 : pos + 1 + role_len].decode("utf-8")
+            pos += 1 + role_len
+        else:
+            role = ROLE_NAMES[code]
+        (content_len,) = struct.unpack_from("<I", payload, pos)
+        pos += 4
+        content = payload[pos : pos + content_len].decode("utf-8")
+        pos += content_len
+        messages.append({"role": role, "content": content})
+    return session_id, messages
+
+
+def _session_id_of(payload: bytes) -> str:
+    (sid_len,) = struct.unpack_from("<H", payload, 0)
+    return payload[2 : 2 + sid_len].decode("utf-8")
+
+
+class SessionSnapshotStore:
+    """
+    Bucketed append-only log of session message lists.
+
+    Args:
+        directory: Where bucket segment files live
+        buckets: Number of bucket files sessions are hashed into
+        compact_ratio: Compact a bucket once its file exceeds this multiple
+            of its live bytes
+        min_compact_bytes: Buckets smaller than this are never compacted
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        buckets: int = 64,
+        compact_ratio: float = 2.0,
+        min_compact_bytes: int = 64 * 1024,
+    ):
+        self.directory = directory
+        self.buckets = buckets
+        self.compact_ratio = compact_ratio
+        self.min_compact_bytes = min_compact_bytes
+        self.compactions = 0
+        self._lock = threading.Lock()
+        # bucket -> session_id -> (offset, record_len); built lazily per bucket
+        self._offsets: Dict[int, Dict[str, Tuple[int, int]]] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        """Latest snapshot of ``session_id``, or None if it was never written."""
+        bucket = self._bucket(session_id)
+        with self._lock:
+            offsets = self._index(bucket)
+            location = offsets.get(session_id)
+            if location is None:
+                return None
+            offset, length = location
+            with open(self._path(bucket), "rb") as f:
+                f.seek(offset + HEADER.size)
+                payload = f.read(length - HEADER.size)
+        return decode_session(payload)[1]
+
+    def write_many(self, sessions: List[Tuple[str, List[Dict[str, str]]]]) -> List[str]:
+        """
+        Append snapshots, grouping the writes per bucket file.
+
+        A session that cannot be encoded is logged and skipped, so it never
+        blocks the rest of the batch.
+
+        Returns:
+            Ids of the sessions written
+        """
+        by_bucket: Dict[int, List[Tuple[str, bytes]]] = {}
+        written: List[str] = []
+        for session_id, messages in sessions:
+            try:
+                payload = encode_session(session_id, messages)
+            except ValueError as e:
+                logger.warning(f"Skipping snapshot of session={session_id[:64]!r}: {e}")
+                continue
+            written.append(session_id)
+            record = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+            by_bucket.setdefault(self._bucket(session_id), []).append((session_id, record))
+
+        with self._lock:
+            for bucket, records in by_bucket.items():
+                # Writers run off the request path, so they pay for the
+                # one-time bucket scan that keeps compaction accounting exact
+                offsets = self._index(bucket)
+                with open(self._path(bucket), "ab") as f:
+                    offset = f.tell()
+                    for session_id, record in records:
+                        f.write(record)
+                        offsets[session_id] = (offset, len(record))
+                        offset += len(record)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._maybe_compact(bucket)
+        return written
+
+    def write(self, session_id: str, messages: List[Dict[str, str]]) -> bool:
+        return bool(self.write_many([(session_id, messages)]))
+
+    def _bucket(self, session_id: str) -> int:
+        return zlib.crc32(session_id.encode("utf-8")) % self.buckets
+
+    def _path(self, bucket: int) -> str:
+        return os.path.join(self.directory, f"bucket-{bucket:04d}.log")
+
+    def _index(self, bucket: int) -> Dict[str, Tuple[int, int]]:
+        offsets = self._offsets.get(bucket)
+        if offsets is None:
+            offsets = self._scan(bucket)
+            self._offsets[bucket] = offsets
+        return offsets
+
+    def _scan(self, bucket: int) -> Dict[str, Tuple[int, int]]:
+        path = self._path(bucket)
+        offsets: Dict[str, Tuple[int, int]] = {}
+        if not os.path.exists(path):
+            return offsets
+        with open(path, "rb") as f:
+            data = f.read()
+        pos = 0
+        while pos + HEADER.size <= len(data):
+            length, crc = HEADER.unpack_from(data, pos)
+            payload = data[pos + HEADER.size : pos + HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            offsets[_session_id_of(payload)] = (pos, HEADER.size + length)
+            pos += HEADER.size + length
+        if pos < len(data):
+            # Torn write from a crash: drop the partial tail record
+            logger.warning(f"Truncating corrupt snapshot tail in {path} at {pos}")
+            with open(path, "r+b") as f:
+                f.truncate(pos)
+        return offsets
+
+    def _maybe_compact(self, bucket: int) -> None:
+        path = self._path(bucket)
+        size = os.path.getsize(path)
+        offsets = self._offsets[bucket]
+        live = sum(length for _, length in offsets.values())
+        if size < self.min_compact_bytes or size <= live * self.compact_ratio:
+            return
+
+        tmp_path = path + ".compact"
+        new_offsets: Dict[str, Tuple[int, int]] = {}
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            for session_id, (offset, length) in offsets.items():
+                src.seek(offset)
+                new_offsets[session_id] = (dst.tell(), length)
+                dst.write(src.read(length))
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, path)
+        self._offsets[bucket] = new_offsets
+        self.compactions += 1
+
+
+class SessionSnapshotter:
+    """
+    Periodically snapshots sessions that changed since their last write.
+
+    Args:
+        store: Destination snapshot store
+        sessions: Callable returning the live ``{session_id: ShortTermMemory}``
+        interval: Seconds between flushes
+    """
+
+    def __init__(
+        self,
+        store: SessionSnapshotStore,
+        sessions: Callable[[], Dict],
+        interval: float = 5.0,
+    ):
+        self.store = store
+        self.sessions = sessions
+        self.interval = interval
+        self.snapshots_written = 0
+        self.snapshots_skipped = 0
+        self._written_versions: Dict[str, int] = {}
+        self._flush_lock = asyncio.Lock()
+
+    def collect_dirty(self) -> List[Tuple[str, int, List[Dict[str, str]]]]:
+        sessions = dict(self.sessions())
+        # Forget sessions that are no longer live, so this map stays bounded
+        # by the live sessions rather than every session ever seen
+        for session_id in [sid for sid in self._written_versions if sid not in sessions]:
+            del self._written_versions[session_id]
+        # Version 0 means untouched since creation or restore: nothing to write
+        dirty = []
+        for session_id, memory in sessions.items():
+            if self._written_versions.get(session_id, 0) != memory.version:
+                dirty.append((session_id, memory.version, memory.build()))
+        return dirty
+
+    async def flush(self) -> int:
+        """
+        Write every dirty session; returns how many were written.
+
+        Cancelling the caller does not abandon a flush midway (its thread
+        would keep writing unrecorded), and flushes never overlap, so a
+        final flush at shutdown cannot write the same records twice.
+        """
+        return await asyncio.shield(asyncio.ensure_future(self._flush()))
+
+    async def _flush(self) -> int:
+        async with self._flush_lock:
+            return await self._write_dirty()
+
+    async def _write_dirty(self) -> int:
+        dirty = self.collect_dirty()
+        if not dirty:
+            return 0
+        # Copies were taken on the event loop; only file IO runs in the thread
+        written = await asyncio.to_thread(
+            self.store.write_many, [(sid, messages) for sid, _, messages in dirty]
+        )
+        # Skipped sessions are marked too: retrying them before they change
+        # would only fail again
+        for session_id, version, _ in dirty:
+            self._written_versions[session_id] = version
+        self.snapshots_written += len(written)
+        self.snapshots_skipped += len(dirty) - len(written)
+        return len(written)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Session snapshot flush failed")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "snapshots_written": self.snapshots_written,
+            "snapshots_skipped": self.snapshots_skipped,
+            "compactions": self.store.compactions,
+        }
@@ -1,29 +1,157 @@
-from typing import List
+from typing import Iterable, List, Optional, Sequence, Tuple
 import hashlib
+import threading
+
+import numpy as np
+
+from src.core.rag.dedup import DEFAULT_MAX_DISTANCE, collapse_near_duplicates, simhash_many
+from src.core.rag.filters import MetadataIndex, SearchFilter
+
+# (text, source, tags) as accepted by add_documents
+Document = Tuple[str, str, Optional[Iterable[str]]]
+
+
+class _Segment:
+    """Immutable run of indexed chunks with its own metadata postings."""
+
+    def __init__(self, items: Sequence[dict], words=None, fingerprints=None):
+        self.items = tuple(items)
+        # Tokenized and fingerprinted once at build time, not on every search
+        self.words = (
+            words
+            if words is not None
+            else tuple(set(item["text"].lower().split()) for item in self.items)
+        )
+        self.fingerprints = (
+            fingerprints
+            if fingerprints is not None
+            else simhash_many([item["text"] for item in self.items])
+        )
+        self.metadata = MetadataIndex()
+        for item in self.items:
+            self.metadata.add(item["source"], item["tags"])
+
+    @classmethod
+    def merge(cls, first: "_Segment", second: "_Segment") -> "_Segment":
+        return cls(
+            first.items + second.items,
+            words=first.words + second.words,
+            fingerprints=np.concatenate([first.fingerprints, second.fingerprints]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class _Snapshot:
+    """What readers see: a tuple of segments and the generation it represents."""
+
+    def __init__(self, segments: Tuple[_Segment, ...], generation: int):
+        self.segments = segments
+        self.generation = generation
+
 
 class VectorMemory:
-    def __init__(self):
-        self._store = []
+    """
+    Copy-on-write keyword store.
+
+    Writers build new chunks into a delta segment off to the side and publish
+    it by swapping in a new snapshot (a single reference assignment), so
+    searches never take a lock and never see a half-written index. Adjacent
+    segments of similar size are merged on the writer side, keeping the
+    segment count logarithmic in the corpus size.
+
+    Results whose SimHash fingerprints lie within ``near_duplicate_distance``
+    bits of a better-ranked result are collapsed (None disables this).
+    """
+
+    # Safe to write from a background thread while searches run
+    copy_on_write = True
+
+    def __init__(self, near_duplicate_distance: Optional[int] = DEFAULT_MAX_DISTANCE):
+        self.near_duplicate_distance = near_duplicate_distance
+        self._snapshot = _Snapshot((), 0)
+        self._write_lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        # Bumped on every publish so retrieval caches can spot stale results
+        return self._snapshot.generation
+
+    def __len__(self) -> int:
+        return sum(len(segment) for segment in self._snapshot.segments)
 
     def _hash(self, text: str) -> str:
         return hashlib.sha256(text.encode()).hexdigest()
 
-    def add(self, text: str, source: str = "doc"):
-        self._store.append({
-            "id": self._hash(text),
-            "text": text,
-            "source": source,
-        })
-
-    def search(self, query: str, k: int = 4) -> List[str]:
-        # TEMP similarity: keyword overlap
-        query_words = set(query.lower().split())
-
-        scored = []
-        for item in self._store:
-            words = set(item["text"].lower().split())
-            score = len(query_words & words)
-            scored.append((score, item["text"]))
-
-        scored.sort(reverse=True)
-        return [text for score, text in scored[:k] if score > 0]
+    def add(self, text: str, source: str = "doc", tags: Optional[Iterable[str]] = None):
+        self.add_documents([(text, source, tags)])
+
+    def add_documents(self, documents: Iterable[Document]) -> int:
+        """Index ``(text, source, tags)`` chunks as one atomic publish."""
+        items = [
+            {
+                "id": self._hash(text),
+                "text": text,
+                "source": source,
+                "tags": list(tags or []),
+            }
+            for text, source, tags in documents
+        ]
+        if not items:
+            return 0
+        delta = _Segment(items)
+
+        with self._write_lock:
+            segments = list(self._snapshot.segments) + [delta]
+            while len(segments) > 1 and len(segments[-2]) <= len(segments[-1]):
+                segments[-2:] = [_Segment.merge(segments[-2], segments[-1])]
+            self._snapshot = _Snapshot(tuple(segments), self._snapshot.generation + 1)
+        return len(items)
+
+    def search(
+        self,
+        query: str,
+        k: int = 4,
+        filters: Optional[SearchFilter] = None,
+    ) -> List[str]:
+        return self.search_batch([query], k, filters=filters)[0]
+
+    def search_batch(
+        self,
+        queries: List[str],
+        k: int = 4,
+        filters: Optional[SearchFilter] = None,
+    ) -> List[List[str]]:
+        # One snapshot for the whole batch: later publishes don't affect it
+        snapshot = self._snapshot
+
+        # Filters resolve to a row mask first, so only matching chunks are scored
+        candidates = []
+        for segment in snapshot.segments:
+            mask = segment.metadata.mask(filters)
+            rows = range(len(segment)) if mask is None else np.flatnonzero(mask)
+            candidates.extend(
+                (segment.words[i], segment.items[i]["text"], segment.fingerprints[i])
+                for i in rows
+            )
+
+        dedupe = self.near_duplicate_distance is not None
+        results = []
+        for query in queries:
+            # TEMP similarity: keyword overlap
+            query_words = set(query.lower().split())
+            scored = [
+                (len(query_words & words), text, fingerprint)
+                for words, text, fingerprint in candidates
+            ]
+            scored.sort(key=lambda item: item[:2], reverse=True)
+            hits = [item for item in scored[: k * 3 if dedupe else k] if item[0] > 0]
+            if dedupe and hits:
+                keep = collapse_near_duplicates(
+                    np.array([item[2] for item in hits], dtype=np.uint64),
+                    self.near_duplicate_distance,
+                )
+                hits = [hits[i] for i in keep]
+            results.append([text for _, text, _ in hits[:k]])
+        return results
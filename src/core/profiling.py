@@ -0,0 +1,301 @@
+"""
+On-demand sampling profiler for production requests.
+
+When switched on (by an admin, for a fraction of ``/chat`` requests and
+optionally a time window) two things are collected:
+
+- Span timings per sampled request (retrieval, prompt assembly, upstream
+  streaming, SSE writes), aggregated across requests.
+- Statistical stack samples of every thread (the event loop and the
+  ``asyncio.to_thread`` workers that run retrieval), taken by a background
+  thread while at least one sampled request is in flight. Each stack is
+  rooted at a ``thread:<name>`` frame; threads parked on a lock or queue are
+  skipped. They can be exported as collapsed stacks (flamegraph.pl /
+  speedscope import) or as a speedscope JSON document with one profile per
+  thread.
+
+When profiling is off no sampler thread exists and ``span()`` returns a
+shared no-op context manager, so instrumented code pays nothing beyond a
+flag check.
+"""
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+# Distinct stacks kept before new ones are folded into a single bucket
+MAX_DISTINCT_STACKS = 10_000
+TRUNCATED_STACK = "[truncated]"
+# A thread whose innermost frame is in one of these is idle (e.g. a pool
+# worker waiting for work) and is not sampled
+IDLE_MODULES = ("threading.py", "queue.py")
+
+_NOOP = nullcontext()
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar(
+    "request_profile", default=None
+)
+_enabled = False
+
+
+class RequestProfile:
+    """Span timings of one sampled request."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+        self.finished = False
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    async def time_iter(self, source: AsyncIterator, name: str) -> AsyncIterator:
+        """Relay ``source``, charging the time spent waiting on it to ``name``."""
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = await source.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    self.add(name, time.perf_counter() - start)
+                yield item
+        finally:
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
+def span(name: str):
+    """Time a block against the current request's profile, if it is sampled."""
+    if not _enabled:
+        return _NOOP
+    profile = _current_profile.get()
+    if profile is None:
+        return _NOOP
+    return profile.span(name)
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame) -> str:
+    """Render a frame chain root-first, ``;``-separated."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def thread_label(name: str) -> str:
+    return f"thread:{name}"
+
+
+class Profiler:
+    """Admin-controlled request sampler plus all-thread stack sampler."""
+
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.interval = 0.005
+        self.until: Optional[float] = None
+        self.sampled_requests = 0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.span_totals: Dict[str, float] = {}
+        self.span_counts: Dict[str, int] = {}
+        self._active_requests = 0
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return _enabled and (self.until is None or time.monotonic() < self.until)
+
+    def enable(
+        self,
+        sample_rate: float = 1.0,
+        duration_seconds: Optional[float] = None,
+        interval_ms: float = 5.0,
+        reset: bool = True,
+    ) -> None:
+        """
+        Start profiling.
+
+        Args:
+            sample_rate: Fraction of requests to profile (0-1)
+            duration_seconds: Stop automatically after this long
+            interval_ms: Stack sampling interval
+            reset: Discard data from previous sessions
+        """
+        global _enabled
+        self.disable()
+        if reset:
+            self.reset()
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000.0
+        self.until = time.monotonic() + duration_seconds if duration_seconds else None
+        self._stop.clear()
+        self._sampler = threading.Thread(
+            target=self._sample_loop, name="stack-sampler", daemon=True
+        )
+        _enabled = True
+        self._sampler.start()
+
+    def disable(self) -> None:
+        global _enabled
+        _enabled = False
+        self._stop.set()
+        if self._sampler is not None and self._sampler is not threading.current_thread():
+            self._sampler.join(timeout=1.0)
+        self._sampler = None
+
+    def reset(self) -> None:
+        with self._lock:
+            self.sampled_requests = 0
+            self.samples = 0
+            self.stacks = Counter()
+            self.span_totals = {}
+            self.span_counts = {}
+
+    def start_request(self, name: str) -> Optional[RequestProfile]:
+        """
+        Decide whether to sample this request.
+
+        Returns:
+            A profile bound to the current context, or None when not sampled
+        """
+        if not _enabled:
+            return None
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        profile = RequestProfile(name)
+        _current_profile.set(profile)
+        with self._lock:
+            self._active_requests += 1
+            self.sampled_requests += 1
+        return profile
+
+    def finish_request(self, profile: RequestProfile) -> None:
+        """Fold a sampled request into the totals; later calls are no-ops."""
+        if profile.finished:
+            return
+        profile.finished = True
+        profile.add("total", time.perf_counter() - profile.started)
+        with self._lock:
+            self._active_requests -= 1
+            for name, seconds in profile.spans.items():
+                self.span_totals[name] = self.span_totals.get(name, 0.0) + seconds
+                self.span_counts[name] = self.span_counts.get(name, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = {
+                name: {
+                    "count": self.span_counts[name],
+                    "total_ms": round(total * 1000, 3),
+                    "mean_ms": round(total * 1000 / self.span_counts[name], 3),
+                }
+                for name, total in self.span_totals.items()
+            }
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "remaining_seconds": (
+                max(self.until - time.monotonic(), 0.0) if self.until and self.enabled else None
+            ),
+            "sampled_requests": self.sampled_requests,
+            "stack_samples": self.samples,
+            "spans": spans,
+        }
+
+    def collapsed(self) -> str:
+        """Stacks in collapsed ``frame;frame;frame count`` format."""
+        with self._lock:
+            items = sorted(self.stacks.items())
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def speedscope(self) -> Dict[str, Any]:
+        """Stack samples as speedscope ``sampled`` profiles, one per thread."""
+        with self._lock:
+            items = sorted(self.stacks.items())
+        frames: List[Dict[str, str]] = []
+        frame_ids: Dict[str, int] = {}
+        by_thread: Dict[str, Dict[str, list]] = {}
+        for stack, count in items:
+            thread, _, rest = stack.partition(";")
+            if not rest:
+                # The truncated bucket has no thread root
+                thread, rest = TRUNCATED_STACK, stack
+            ids = []
+            for label in rest.split(";"):
+                if label not in frame_ids:
+                    frame_ids[label] = len(frames)
+                    frames.append({"name": label})
+                ids.append(frame_ids[label])
+            profile = by_thread.setdefault(thread, {"samples": [], "weights": []})
+            profile["samples"].append(ids)
+            profile["weights"].append(count * self.interval * 1000)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": thread,
+                    "unit": "milliseconds",
+                    "startValue": 0,
+                    "endValue": sum(profile["weights"]),
+                    "samples": profile["samples"],
+                    "weights": profile["weights"],
+                }
+                for thread, profile in by_thread.items()
+            ],
+            "name": "ai-coding-agent-backend",
+            "exporter": "src.core.profiling",
+        }
+
+    def _sample_loop(self) -> None:
+        global _enabled
+        while not self._stop.wait(self.interval):
+            if self.until is not None and time.monotonic() >= self.until:
+                _enabled = False
+                return
+            if not self._active_requests:
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == threading.get_ident() or _is_idle(frame):
+                    continue
+                label = thread_label(names.get(ident, str(ident)))
+                stacks.append(f"{label};{collapse_stack(frame)}")
+            if not stacks:
+                continue
+            with self._lock:
+                for stack in stacks:
+                    if stack not in self.stacks and len(self.stacks) >= MAX_DISTINCT_STACKS:
+                        stack = TRUNCATED_STACK
+                    self.stacks[stack] += 1
+                self.samples += 1
+
+
+def _is_idle(frame) -> bool:
+    return os.path.basename(frame.f_code.co_filename) in IDLE_MODULES
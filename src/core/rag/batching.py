@@ -0,0 +1,135 @@
+"""
+Micro-batching of concurrent retrieval queries.
+
+Each ``/chat`` request used to embed and score its query on its own, so N
+concurrent requests paid for N matrix-vector products. :class:`QueryBatcher`
+holds queries for at most ``max_wait`` seconds (or until ``max_batch_size``
+are queued), then hands each group sharing ``top_k`` and filters to the
+store's ``search_batch`` - one embedding call and one matrix-matrix product -
+and resolves every caller's future with its own results. A caller may pass
+a ``rerank`` step, which runs on the same worker thread as the search.
+"""
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from src.core.logger import get_logger
+from src.core.rag.filters import SearchFilter
+
+logger = get_logger()
+
+# (query, results) -> reranked results
+Rerank = Callable[[str, List], List]
+_Pending = Tuple[str, int, Optional[SearchFilter], Optional[Rerank], asyncio.Future]
+
+
+class QueryBatcher:
+    """
+    Collects concurrent searches against ``store`` into batches.
+
+    Args:
+        store: Retrieval store; ``search_batch(queries, top_k, filters=...)``
+            is used when available, otherwise ``search`` per query
+        max_wait: Longest a query waits for companions, in seconds
+        max_batch_size: Flush as soon as this many queries are queued
+    """
+
+    def __init__(self, store, max_wait: float = 0.002, max_batch_size: int = 32):
+        self.store = store
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.queries = 0
+        self.largest_batch = 0
+        self._pending: List[_Pending] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        # Store calls run off the event loop one batch at a time; stores are
+        # not thread-safe, and queries queue up into the next batch meanwhile
+        self._lock = asyncio.Lock()
+
+    async def search(
+        self,
+        query: str,
+        top_k: int,
+        filters: Optional[SearchFilter] = None,
+        rerank: Optional[Rerank] = None,
+    ) -> List:
+        """
+        Search ``query`` as part of the next batch.
+
+        Args:
+            rerank: Applied to this query's results off the event loop
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query, top_k, filters, rerank, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch_size": self.queries / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[_Pending]) -> None:
+        groups: Dict[Tuple[int, Optional[SearchFilter]], List[_Pending]] = {}
+        for item in batch:
+            groups.setdefault((item[1], item[2]), []).append(item)
+
+        async with self._lock:
+            for (top_k, filters), items in groups.items():
+                queries = [(query, rerank) for query, _, _, rerank, _ in items]
+                try:
+                    results = await asyncio.to_thread(
+                        self._search_batch, queries, top_k, filters
+                    )
+                except Exception as e:
+                    logger.exception("Batched retrieval failed")
+                    for *_, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                self.batches += 1
+                self.queries += len(items)
+                self.largest_batch = max(self.largest_batch, len(items))
+                for (*_, future), result in zip(items, results):
+                    # The caller may have gone away (request cancelled)
+                    if not future.done():
+                        future.set_result(result)
+
+    def _search_batch(
+        self,
+        queries: List[Tuple[str, Optional[Rerank]]],
+        top_k: int,
+        filters: Optional[SearchFilter],
+    ) -> List[List]:
+        texts = [query for query, _ in queries]
+        search_batch = getattr(self.store, "search_batch", None)
+        if search_batch is not None:
+            results = search_batch(texts, top_k, filters=filters)
+        else:
+            results = [self.store.search(query, top_k, filters=filters) for query in texts]
+        return [
+            rerank(query, result) if rerank is not None else result
+            for (query, rerank), result in zip(queries, results)
+        ]
@@ -0,0 +1,390 @@
+"""
+Retrieval quality-vs-latency benchmark.
+
+Builds each backend on a deterministic synthetic corpus, then reports:
+
+- quality against an exhaustive reference of the same kind and the same
+  near-duplicate setting (tie-aware ``recall@k``, ``mrr`` of the reference's
+  top hit) and against the query labels
+  (``label_mrr``, ``label_hit@k``: the chunk each query was drawn from)
+- per-query latency percentiles and QPS at 1..N threads
+- build time and index memory
+
+Output is a single JSON document meant to be stored per commit and diffed::
+
+    python -m src.core.rag.benchmark --chunks 100000 --backend memory \\
+        --backend store:flat:int8 --backend store:ivf:float32 --threads 1,2,4 \\
+        --output bench.json
+
+The corpus is generated block by block from ``(seed, block)``, so any chunk
+can be regenerated without materializing the corpus; millions of chunks only
+cost what the backends themselves store.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.core.memory.vector_memory import VectorMemory
+from src.core.rag.dedup import DEFAULT_MAX_DISTANCE
+from src.core.rag.evaluation import recall_at_k
+from src.core.rag.vector_store import VectorStore
+
+BLOCK_SIZE = 10_000
+
+
+@dataclass
+class SyntheticCorpus:
+    """
+    Topic-clustered bag-of-words chunks.
+
+    Each topic owns a slice of the vocabulary. A chunk draws most of its
+    words from its topic slice and the rest from the whole vocabulary, both
+    following Zipf's law (s=1), which gives realistic term skew and cluster
+    structure (so IVF partitioning is meaningful).
+    """
+
+    chunks: int
+    vocab_size: int = 50_000
+    topics: int = 200
+    words_per_chunk: int = 40
+    topic_share: float = 0.7
+    seed: int = 0
+
+    def block(self, b: int) -> List[str]:
+        start = b * BLOCK_SIZE
+        size = min(BLOCK_SIZE, self.chunks - start)
+        if size <= 0:
+            return []
+        rng = np.random.default_rng([self.seed, 0, b])
+        topic_words = self.vocab_size // self.topics
+        shape = (size, self.words_per_chunk)
+        topics = rng.integers(self.topics, size=size)
+        in_topic = topics[:, None] * topic_words + _zipf(rng, topic_words, shape)
+        common = _zipf(rng, self.vocab_size, shape)
+        from_topic = rng.random(shape) < self.topic_share
+        words = np.where(from_topic, in_topic, common)
+        return [" ".join(f"w{w}" for w in row) for row in words]
+
+    def iter_blocks(self) -> Iterator[List[str]]:
+        for b in range((self.chunks + BLOCK_SIZE - 1) // BLOCK_SIZE):
+            yield self.block(b)
+
+    def chunk(self, i: int) -> str:
+        return self.block(i // BLOCK_SIZE)[i % BLOCK_SIZE]
+
+    def queries(self, n: int, words: int = 5) -> List[Tuple[str, str]]:
+        """``n`` labelled queries: (query, text of the chunk it was drawn from)."""
+        rng = np.random.default_rng([self.seed, 1])
+        sources = np.sort(rng.choice(self.chunks, size=min(n, self.chunks), replace=False))
+        out = []
+        cached_block, block_texts = None, []
+        for i in sources:
+            if i // BLOCK_SIZE != cached_block:
+                cached_block = i // BLOCK_SIZE
+                block_texts = self.block(cached_block)
+            text = block_texts[i % BLOCK_SIZE]
+            tokens = list(dict.fromkeys(text.split()))
+            picked = rng.choice(len(tokens), size=min(words, len(tokens)), replace=False)
+            out.append((" ".join(tokens[j] for j in sorted(picked)), text))
+        order = rng.permutation(len(out))
+        return [out[j] for j in order]
+
+
+def _zipf(rng: np.random.Generator, n: int, shape, s: float = 1.0) -> np.ndarray:
+    """Ranks in [0, n) with P(rank r) proportional to 1 / (r + 1) ** s."""
+    cdf = np.cumsum(1.0 / np.arange(1, n + 1) ** s)
+    return np.searchsorted(cdf, rng.random(shape) * cdf[-1])
+
+
+@dataclass
+class Backend:
+    """
+    A configuration under test plus its exhaustive reference.
+
+    ``spec`` is ``memory`` or ``store[:index[:dtype[:nprobe]]]``, e.g.
+    ``store:ivf:int8:32``. The exact reference collapses near-duplicates
+    exactly like the backend, so dedup is not counted as lost recall.
+    """
+
+    spec: str
+    near_duplicate_distance: Optional[int] = DEFAULT_MAX_DISTANCE
+
+    @property
+    def kind(self) -> str:
+        return self.spec.split(":")[0]
+
+    @property
+    def reference_key(self) -> Tuple[str, Optional[int]]:
+        return self.kind, self.near_duplicate_distance
+
+    def create(self, exact: bool = False):
+        kind, *options = self.spec.split(":")
+        dedupe = self.near_duplicate_distance
+        if kind == "memory":
+            # Keyword search is exhaustive already
+            return VectorMemory(near_duplicate_distance=dedupe)
+        if kind == "store":
+            # No query-embedding cache: repeated queries would time the cache
+            if exact:
+                return VectorStore(embedding_cache_size=0, near_duplicate_distance=dedupe)
+            index = options[0] if options else "flat"
+            dtype = options[1] if len(options) > 1 else "float32"
+            nprobe = int(options[2]) if len(options) > 2 else 8
+            return VectorStore(
+                index=index,
+                dtype=dtype,
+                nprobe=nprobe,
+                embedding_cache_size=0,
+                near_duplicate_distance=dedupe,
+            )
+        raise ValueError(f"Unknown backend spec: {self.spec}")
+
+    def exact_scores(self, store, query: str, texts: Sequence[str]) -> np.ndarray:
+        """Scores of ``texts`` for ``query`` as the exact reference ranks them."""
+        if self.kind == "memory":
+            query_words = set(query.lower().split())
+            return np.array(
+                [len(query_words & set(text.lower().split())) for text in texts],
+                dtype=np.float32,
+            )
+        # Full-precision embeddings, whatever dtype the store keeps
+        vectors = store.embedder.embed(list(texts) + [query])
+        return vectors[:-1] @ vectors[-1]
+
+
+def build(store, corpus: SyntheticCorpus) -> Dict[str, float]:
+    # Resident-set growth is approximate: freed earlier backends can offset it
+    gc.collect()
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    for block in corpus.iter_blocks():
+        store.add_documents((text, "bench", None) for text in block)
+    if isinstance(store, VectorStore):
+        store.train()
+    seconds = time.perf_counter() - start
+    rss_after = _rss_bytes()
+    stats = {
+        "build_seconds": round(seconds, 3),
+        "chunks_per_second": round(corpus.chunks / seconds, 1) if seconds else None,
+        "rss_delta_bytes": (
+            rss_after - rss_before if rss_before is not None and rss_after is not None else None
+        ),
+    }
+    if isinstance(store, VectorStore):
+        stats["index_bytes"] = int(store.index.nbytes)
+    return stats
+
+
+def search_texts(store, query: str, k: int) -> List[str]:
+    return [hit if isinstance(hit, str) else hit["text"] for hit in store.search(query, k)]
+
+
+def quality(
+    results: Sequence[List[str]],
+    reference: Sequence[List[str]],
+    labels: Sequence[str],
+    k: int,
+    scores: Optional[Callable[[int, List[str]], np.ndarray]] = None,
+) -> Dict[str, float]:
+    """
+    Args:
+        scores: ``scores(i, texts)`` gives the exact scores of ``texts`` for
+            query ``i``; when given, recall counts results tied with the
+            reference's k-th hit as found (see ``recall_at_k``)
+    """
+    recalls, rr, label_rr, label_hits = [], [], [], []
+    for i, (got, want, label) in enumerate(zip(results, reference, labels)):
+        if want:
+            # Texts mapped to local ids, so the id-based metric applies
+            texts = list(dict.fromkeys(want + got))
+            ids = {text: j for j, text in enumerate(texts)}
+            recalls.append(
+                recall_at_k(
+                    np.array([[ids[text] for text in got]], dtype=np.int64),
+                    np.array([[ids[text] for text in want]], dtype=np.int64),
+                    scores(i, texts)[None, :] if scores is not None else None,
+                )
+            )
+            rr.append(1.0 / (got.index(want[0]) + 1) if want[0] in got else 0.0)
+        label_rr.append(1.0 / (got.index(label) + 1) if label in got else 0.0)
+        label_hits.append(float(label in got))
+    return {
+        f"recall@{k}": _mean(recalls),
+        "mrr": _mean(rr),
+        "label_mrr": _mean(label_rr),
+        f"label_hit@{k}": _mean(label_hits),
+    }
+
+
+def latency(
+    search: Callable[[str], object],
+    queries: Sequence[str],
+    threads: Sequence[int],
+) -> Dict[str, Dict[str, float]]:
+    """Per-query latency percentiles (ms) and QPS for each thread count."""
+    out = {}
+    for n in threads:
+        def timed(query: str) -> float:
+            start = time.perf_counter()
+            search(query)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        if n == 1:
+            samples = [timed(q) for q in queries]
+        else:
+            with ThreadPoolExecutor(max_workers=n) as pool:
+                samples = list(pool.map(timed, queries))
+        wall = time.perf_counter() - start
+        ms = np.asarray(samples) * 1000
+        out[str(n)] = {
+            "qps": round(len(queries) / wall, 1),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p90_ms": round(float(np.percentile(ms, 90)), 3),
+            "p99_ms": round(float(np.percentile(ms, 99)), 3),
+            "max_ms": round(float(ms.max()), 3),
+        }
+    return out
+
+
+def run_benchmark(
+    corpus: SyntheticCorpus,
+    backends: Sequence[str],
+    queries: int = 200,
+    k: int = 10,
+    threads: Sequence[int] = (1,),
+    with_quality: bool = True,
+) -> Dict:
+    labelled = corpus.queries(queries)
+    query_texts = [q for q, _ in labelled]
+    labels = [label for _, label in labelled]
+    references: Dict[Tuple[str, Optional[int]], List[List[str]]] = {}
+    report = {
+        "meta": _meta(),
+        "corpus": {
+            "chunks": corpus.chunks,
+            "vocab_size": corpus.vocab_size,
+            "topics": corpus.topics,
+            "words_per_chunk": corpus.words_per_chunk,
+            "seed": corpus.seed,
+        },
+        "queries": len(query_texts),
+        "k": k,
+        "backends": {},
+    }
+
+    for spec in backends:
+        backend = Backend(spec)
+        store = backend.create()
+        entry = {"build": build(store, corpus)}
+        results = [search_texts(store, q, k) for q in query_texts]
+        if with_quality:
+            key = backend.reference_key
+            if key not in references:
+                # One exhaustive reference per kind and dedup setting, built once
+                exact = backend.create(exact=True)
+                build(exact, corpus)
+                references[key] = [search_texts(exact, q, k) for q in query_texts]
+                del exact
+            entry["quality"] = quality(
+                results,
+                references[key],
+                labels,
+                k,
+                scores=lambda i, texts: backend.exact_scores(store, query_texts[i], texts),
+            )
+        entry["latency"] = latency(lambda q: store.search(q, k), query_texts, threads)
+        report["backends"][spec] = entry
+        del store
+    return report
+
+
+def _mean(values: List[float]) -> Optional[float]:
+    return round(float(np.mean(values)), 4) if values else None
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _meta() -> Dict[str, Optional[str]]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Retrieval quality-vs-latency benchmark")
+    parser.add_argument("--chunks", type=int, default=20_000, help="Synthetic corpus size")
+    parser.add_argument("--queries", type=int, default=200, help="Labelled queries")
+    parser.add_argument("--k", type=int, default=10, help="Results per query")
+    parser.add_argument(
+        "--backend",
+        action="append",
+        help="memory | store[:flat|ivf[:float32|float16|int8[:nprobe]]] (repeatable)",
+    )
+    parser.add_argument(
+        "--threads",
+        default="1,2,4",
+        help="Comma-separated thread counts for QPS",
+    )
+    parser.add_argument("--vocab", type=int, default=50_000, help="Vocabulary size")
+    parser.add_argument("--topics", type=int, default=200, help="Topic clusters")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--skip-quality",
+        action="store_true",
+        help="Skip building exhaustive references (latency/build only)",
+    )
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    corpus = SyntheticCorpus(
+        chunks=args.chunks,
+        vocab_size=args.vocab,
+        topics=args.topics,
+        seed=args.seed,
+    )
+    report = run_benchmark(
+        corpus,
+        args.backend or ["memory", "store:flat:float32", "store:ivf:int8"],
+        queries=args.queries,
+        k=args.k,
+        threads=[int(n) for n in args.threads.split(",")],
+        with_quality=not args.skip_quality,
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
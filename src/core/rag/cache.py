@@ -0,0 +1,139 @@
+"""
+Caches in front of retrieval.
+
+:class:`RetrievalCache` memoizes search results keyed on the normalized
+query, ``k`` and filters. Each entry remembers the index *generation* it was
+computed against; stores bump their generation on every mutation, so stale
+entries are detected and dropped on lookup without flushing the whole cache.
+:class:`QueryEmbeddingCache` keeps recent query embeddings in front of an
+embedder.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive cache key for a query."""
+    return " ".join(query.lower().split())
+
+
+class LRUCache:
+    """Minimal bounded least-recently-used mapping."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+
+class RetrievalCache:
+    """
+    Generation-aware LRU cache of retrieval results.
+
+    Also tracks hit rate and an estimate of the retrieval time saved
+    (hits multiplied by the mean cost of a miss).
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self._lru = LRUCache(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.miss_seconds = 0.0
+
+    def get(self, key: Hashable, generation: int) -> Optional[Any]:
+        entry = self._lru.get(key)
+        if entry is not None:
+            entry_generation, value = entry
+            if entry_generation == generation:
+                self.hits += 1
+                return value
+            self._lru.pop(key)
+            self.stale += 1
+        self.misses += 1
+        return None
+
+    def put(self, key: Hashable, generation: int, value: Any, seconds: float = 0.0) -> None:
+        """Store ``value`` computed against ``generation`` in ``seconds``."""
+        self.miss_seconds += seconds
+        self._lru.put(key, (generation, value))
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        mean_miss = self.miss_seconds / self.misses if self.misses else 0.0
+        return {
+            "entries": len(self._lru),
+            "max_entries": self._lru.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "mean_miss_ms": round(mean_miss * 1000, 3),
+            "saved_ms": round(self.hits * mean_miss * 1000, 3),
+        }
+
+
+
+class QueryEmbeddingCache:
+    """
+    LRU of query embeddings keyed on the normalized query.
+
+    The normalized form is only the key: a miss embeds the query text as
+    given, so embedders that are case- or whitespace-sensitive see their
+    real input.
+    """
+
+    def __init__(self, embedder, max_entries: int = 1024):
+        self.embedder = embedder
+        self._lru = LRUCache(max_entries)
+        # Called from batcher and MMR worker threads
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def embed(self, queries: List[str]) -> np.ndarray:
+        """Embed queries (shape (n, dim)); cache misses are embedded together."""
+        keys = [normalize_query(query) for query in queries]
+        with self._lock:
+            vectors = [self._lru.get(key) for key in keys]
+        # First spelling of each missing key, in order of appearance
+        missing: Dict[str, str] = {}
+        for key, query, vector in zip(keys, queries, vectors):
+            if vector is None:
+                missing.setdefault(key, query)
+        if missing:
+            embedded = dict(
+                zip(missing, self.embedder.embed(list(missing.values()))[:, None, :])
+            )
+            with self._lock:
+                for key, vector in embedded.items():
+                    self._lru.put(key, vector)
+            vectors = [
+                embedded[key] if vector is None else vector
+                for key, vector in zip(keys, vectors)
+            ]
+        # A single query hands back the cached array itself, without a copy
+        return vectors[0] if len(vectors) == 1 else np.vstack(vectors)
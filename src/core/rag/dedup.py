@@ -0,0 +1,124 @@
+"""
+Near-duplicate detection and result diversification.
+
+Documentation corpora repeat paragraphs with small edits, so plain top-k
+retrieval often returns the same text several times. Two cheap stages
+counter that:
+
+- **SimHash** fingerprints (64 bits, over word counts) are computed once per
+  chunk at ingest time. Chunks whose fingerprints differ in at most a few
+  bits are near-duplicates; collapsing a ranked candidate list is a single
+  pairwise XOR/popcount over the candidates.
+- **Maximal marginal relevance** re-ranks a candidate pool, trading query
+  relevance against similarity to what was already picked. The pairwise
+  similarity matrix is computed once, so selection is O(k * candidates)
+  vector work.
+"""
+import hashlib
+from collections import Counter
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+
+from src.core.rag.embeddings import tokenize
+
+FINGERPRINT_BITS = 64
+# Fingerprints at most this many bits apart count as near-duplicates. Two
+# edited words moved 60-word chunks by 5 bits (median, 8 at p90) and
+# 20-word chunks by 7-10; distinct README paragraphs sat 18+ bits apart
+DEFAULT_MAX_DISTANCE = 10
+
+
+@lru_cache(maxsize=65536)
+def _token_hash(token: str) -> int:
+    # Stable across processes, unlike hash(); 64 bits for a 64-bit SimHash
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _bits(values: np.ndarray) -> np.ndarray:
+    """Unpack uint64 values into an (..., 64) array of 0/1, least significant first."""
+    as_bytes = np.ascontiguousarray(values, dtype="<u8").view(np.uint8)
+    return np.unpackbits(as_bytes.reshape(*values.shape, 8), axis=-1, bitorder="little")
+
+
+def simhash(text: str) -> int:
+    counts = Counter(tokenize(text))
+    if not counts:
+        return 0
+    hashes = np.fromiter((_token_hash(t) for t in counts), dtype=np.uint64, count=len(counts))
+    weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+    votes = weights @ (_bits(hashes).astype(np.float64) * 2 - 1)
+    packed = np.packbits((votes > 0).astype(np.uint8), bitorder="little")
+    return int(packed.view("<u8")[0])
+
+
+def simhash_many(texts: List[str]) -> np.ndarray:
+    """Fingerprints of ``texts`` as a uint64 array."""
+    return np.fromiter((simhash(text) for text in texts), dtype=np.uint64, count=len(texts))
+
+
+def pairwise_hamming(fingerprints: np.ndarray) -> np.ndarray:
+    fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+    xor = fingerprints[:, None] ^ fingerprints[None, :]
+    return _bits(xor).sum(axis=-1, dtype=np.int64)
+
+
+def collapse_near_duplicates(
+    fingerprints: np.ndarray, max_distance: int = DEFAULT_MAX_DISTANCE
+) -> np.ndarray:
+    """
+    Positions to keep from a ranked list, dropping near-duplicates of
+    better-ranked entries.
+    """
+    n = len(fingerprints)
+    if n < 2:
+        return np.arange(n)
+    close = pairwise_hamming(fingerprints) <= max_distance
+    suppressed = np.zeros(n, dtype=bool)
+    keep = []
+    for i in range(n):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= close[i]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def mmr_select(
+    query: np.ndarray,
+    candidates: np.ndarray,
+    k: int,
+    lambda_: float = 0.7,
+) -> np.ndarray:
+    """
+    Maximal marginal relevance selection.
+
+    Args:
+        query: Normalized query vector, shape (dim,)
+        candidates: Normalized candidate vectors, shape (n, dim)
+        k: How many to select
+        lambda_: 1.0 is pure relevance, 0.0 pure diversity
+
+    Returns:
+        Selected candidate positions in pick order
+    """
+    n = len(candidates)
+    k = min(k, n)
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+    # Highest similarity of each candidate to anything selected so far
+    redundancy = np.full(n, -np.inf)
+    available = np.ones(n, dtype=bool)
+    picked = []
+    for step in range(k):
+        penalty = np.maximum(redundancy, 0.0) if step else 0.0
+        score = lambda_ * relevance - (1 - lambda_) * penalty
+        score[~available] = -np.inf
+        best = int(np.argmax(score))
+        picked.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return np.asarray(picked, dtype=np.int64)
@@ -0,0 +1,61 @@
+"""
+Text embedding backends for the vector store.
+
+The default embedder is dependency-free: it hashes word tokens into a fixed
+number of signed buckets, which gives deterministic, restart-stable vectors
+whose inner product approximates keyword overlap. A model-based embedder can
+be swapped in by passing any object with ``dim`` and ``embed(texts)``.
+"""
+import re
+import zlib
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from src.core.exceptions import ConfigurationError
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class HashingEmbedder:
+    """Signed feature-hashing bag-of-words embeddings (L2-normalized float32)."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self._buckets: Dict[str, Tuple[int, float]] = {}
+
+    def _bucket(self, token: str) -> Tuple[int, float]:
+        cached = self._buckets.get(token)
+        if cached is None:
+            # crc32 is stable across processes, unlike the builtin hash()
+            h = zlib.crc32(token.encode("utf-8"))
+            cached = (h % self.dim, 1.0 if (h >> 31) & 1 else -1.0)
+            self._buckets[token] = cached
+        return cached
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in set(tokenize(text)):
+                idx, sign = self._bucket(token)
+                out[row, idx] += sign
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+def load_embedder(model: Union[str, object] = "hashing"):
+    """
+    Resolve an embedder from a name or pass an embedder object through.
+
+    ``"hashing"`` and ``"test"`` both select :class:`HashingEmbedder`.
+    """
+    if not isinstance(model, str):
+        return model
+    if model in ("hashing", "test"):
+        return HashingEmbedder()
+    raise ConfigurationError(f"Unknown embedding model: {model}")
@@ -0,0 +1,36 @@
+"""Retrieval quality metrics against exact (float32, exhaustive) search."""
+from typing import Optional
+
+import numpy as np
+
+# Exact scores closer than this are treated as ties
+TIE_TOLERANCE = 1e-5
+
+
+def recall_at_k(
+    retrieved: np.ndarray,
+    expected: np.ndarray,
+    exact_scores: Optional[np.ndarray] = None,
+) -> float:
+    """
+    Mean fraction of the exact top-k that was retrieved.
+
+    Args:
+        retrieved: Approximate result ids, shape (nq, k)
+        expected: Exact result ids, shape (nq, k)
+        exact_scores: Optional exact score matrix, shape (nq, n). When given,
+            a retrieved id scoring as high as the k-th exact result counts as
+            a hit, so ties at the cut-off are not reported as misses.
+    """
+    hits = []
+    for q, (got, want) in enumerate(zip(retrieved, expected)):
+        if not len(want):
+            continue
+        got = got[got >= 0]
+        if exact_scores is None:
+            found = len(np.intersect1d(got, want))
+        else:
+            cutoff = exact_scores[q, want].min() - TIE_TOLERANCE
+            found = int((exact_scores[q, got] >= cutoff).sum())
+        hits.append(min(found, len(want)) / len(want))
+    return float(np.mean(hits)) if hits else 1.0
@@ -0,0 +1,129 @@
+"""
+Metadata filtering for retrieval.
+
+Every indexed chunk has a ``source`` (usually a file path) and optional
+``tags``. :class:`MetadataIndex` keeps a packed bitset of rows per source
+and per tag, updated as rows are added (one bit per row per distinct value),
+so a :class:`SearchFilter` resolves to a NumPy boolean row mask by OR-ing
+and AND-ing cached bitsets *before* any vector is scored; stores then score
+only the masked rows instead of over-fetching and post-filtering.
+"""
+import bisect
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """
+    Restrict retrieval to matching chunks. All given conditions must hold.
+
+    Attributes:
+        sources: Chunk source must be one of these
+        path_prefix: Chunk source must start with this prefix
+        tags: Chunk must carry every one of these tags
+    """
+
+    sources: Optional[frozenset] = None
+    path_prefix: Optional[str] = None
+    tags: Optional[frozenset] = None
+
+    @classmethod
+    def create(
+        cls,
+        sources: Optional[Iterable[str]] = None,
+        path_prefix: Optional[str] = None,
+        tags: Optional[Iterable[str]] = None,
+    ) -> "SearchFilter":
+        return cls(
+            sources=frozenset(sources) if sources is not None else None,
+            path_prefix=path_prefix or None,
+            tags=frozenset(tags) if tags else None,
+        )
+
+    @property
+    def empty(self) -> bool:
+        return self.sources is None and self.path_prefix is None and self.tags is None
+
+
+class _Bitset:
+    """Growable packed bitset (little-endian bit order) of row ids."""
+
+    def __init__(self):
+        self.bits = np.zeros(0, dtype=np.uint8)
+
+    def add(self, row: int) -> None:
+        byte = row >> 3
+        if byte >= len(self.bits):
+            grown = np.zeros(max(byte + 1, len(self.bits) * 2, 8), dtype=np.uint8)
+            grown[: len(self.bits)] = self.bits
+            self.bits = grown
+        self.bits[byte] |= np.uint8(1 << (row & 7))
+
+    def or_into(self, out: np.ndarray) -> None:
+        n = min(len(self.bits), len(out))
+        np.bitwise_or(out[:n], self.bits[:n], out=out[:n])
+
+
+class MetadataIndex:
+    """Per-source and per-tag row bitsets for the rows of a store."""
+
+    def __init__(self):
+        self._size = 0
+        self._by_source: Dict[str, _Bitset] = {}
+        self._by_tag: Dict[str, _Bitset] = {}
+        self._sorted_sources: List[str] = []
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, source: str, tags: Optional[Iterable[str]] = None) -> int:
+        """Register the next row; returns its id."""
+        row = self._size
+        self._size += 1
+        if source not in self._by_source:
+            self._by_source[source] = _Bitset()
+            bisect.insort(self._sorted_sources, source)
+        self._by_source[source].add(row)
+        for tag in tags or ():
+            self._by_tag.setdefault(tag, _Bitset()).add(row)
+        return row
+
+    def sources_with_prefix(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self._sorted_sources, prefix)
+        out = []
+        for source in self._sorted_sources[start:]:
+            if not source.startswith(prefix):
+                break
+            out.append(source)
+        return out
+
+    def mask(self, search_filter: Optional[SearchFilter]) -> Optional[np.ndarray]:
+        """
+        Boolean row mask for ``search_filter`` (None means "all rows").
+        """
+        if search_filter is None or search_filter.empty:
+            return None
+        bits: Optional[np.ndarray] = None
+        # Each group ORs its values; the groups are then ANDed together
+        groups: List[Tuple[Dict[str, _Bitset], Iterable[str]]] = []
+        if search_filter.sources is not None:
+            groups.append((self._by_source, search_filter.sources))
+        if search_filter.path_prefix is not None:
+            prefixed = self.sources_with_prefix(search_filter.path_prefix)
+            groups.append((self._by_source, prefixed))
+        for tag in search_filter.tags or ():
+            groups.append((self._by_tag, [tag]))
+        for bitsets, values in groups:
+            matched = self._union(bitsets, values)
+            bits = matched if bits is None else np.bitwise_and(bits, matched, out=bits)
+        return np.unpackbits(bits, count=self._size, bitorder="little").astype(bool)
+
+    def _union(self, bitsets: Dict[str, _Bitset], values: Iterable[str]) -> np.ndarray:
+        out = np.zeros((self._size + 7) // 8, dtype=np.uint8)
+        for value in values:
+            if value in bitsets:
+                bitsets[value].or_into(out)
+        return out
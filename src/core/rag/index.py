@@ -0,0 +1,403 @@
+"""
+Vector indexes used by :class:`~src.core.rag.vector_store.VectorStore`.
+
+Indexes score L2-normalized query vectors against stored vectors by inner
+product (cosine similarity). When vectors are stored in a compact dtype the
+search runs in two stages: a coarse top-k' pass over the compact codes, then
+an exact re-rank of those candidates using full-precision vectors supplied
+by the caller.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.core.rag.quantization import QuantizedMatrix
+
+# Maps row ids to their exact float32 vectors (shape (len(ids), dim))
+ExactVectors = Callable[[np.ndarray], np.ndarray]
+
+# Stored rows decoded at a time when (re)assigning the corpus to lists
+ASSIGN_BLOCK_ROWS = 16384
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row-wise top-k of a score matrix, best first.
+
+    Returns:
+        ``(scores, columns)`` each of shape (nq, min(k, ncols))
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.zeros((len(scores), 0))
+        return empty.astype(np.float32), empty.astype(np.int64)
+    if k < scores.shape[1]:
+        cols = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        cols = np.broadcast_to(np.arange(k), (len(scores), k))
+    picked = np.take_along_axis(scores, cols, axis=1)
+    order = np.argsort(-picked, axis=1, kind="stable")
+    return (
+        np.take_along_axis(picked, order, axis=1),
+        np.take_along_axis(cols, order, axis=1),
+    )
+
+
+class FlatIndex:
+    """
+    Exhaustive inner-product index.
+
+    Args:
+        dim: Vector dimensionality
+        dtype: Storage dtype, one of ``float32``, ``float16``, ``int8``
+        rerank_factor: Candidates kept per result for exact re-ranking
+            (``k' = k * rerank_factor``); ignored for float32 storage
+    """
+
+    def __init__(self, dim: int, dtype: str = "float32", rerank_factor: int = 4):
+        self.dim = dim
+        self.rerank_factor = rerank_factor
+        self.vectors = QuantizedMatrix(dim, dtype)
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def dtype(self) -> str:
+        return self.vectors.dtype
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.vectors.bytes_per_vector
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes
+
+    def add(self, vectors: np.ndarray) -> None:
+        self.vectors.add(vectors)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """Arrays needed to restore the index (see ``restore``)."""
+        state = {"codes": self.vectors.codes}
+        if self.vectors.scales is not None:
+            state["scales"] = self.vectors.scales
+        return state
+
+    def restore(self, state: Dict[str, np.ndarray]) -> None:
+        self.vectors = QuantizedMatrix.from_arrays(state["codes"], state.get("scales"))
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        exact: Optional[ExactVectors] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the ``k`` best rows for each query.
+
+        Args:
+            queries: float32 array of shape (nq, dim)
+            k: Results per query
+            exact: Source of full-precision vectors for re-ranking
+            mask: Optional boolean row mask; only masked rows are scored
+
+        Returns:
+            ``(scores, ids)`` of shape (nq, min(k, candidate rows))
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        rows = None if mask is None else np.flatnonzero(mask)
+        scores = self.vectors.scores(queries, rows)
+        keep = k if self.dtype == "float32" or exact is None else k * self.rerank_factor
+        best, cols = top_k_rows(scores, keep)
+        ids = cols if rows is None else rows[cols]
+        if keep == k or ids.shape[1] == 0:
+            return best, ids
+        return rerank(queries, ids, k, exact)
+
+
+def rerank(
+    queries: np.ndarray,
+    candidates: np.ndarray,
+    k: int,
+    exact: ExactVectors,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exactly re-score per-query candidate ids and keep the best ``k``.
+
+    Candidates of all queries are fetched from ``exact`` in a single call.
+    """
+    unique, inverse = np.unique(candidates, return_inverse=True)
+    vectors = exact(unique)
+    inverse = inverse.reshape(candidates.shape)
+    exact_scores = np.einsum("qd,qcd->qc", queries, vectors[inverse])
+    scores, cols = top_k_rows(exact_scores, k)
+    return scores, np.take_along_axis(candidates, cols, axis=1)
+
+
+def _pad(scores: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Right-pad result rows to width ``k`` with -inf scores and -1 ids."""
+    missing = k - scores.shape[1]
+    if missing <= 0:
+        return scores[:, :k], ids[:, :k]
+    return (
+        np.pad(scores, ((0, 0), (0, missing)), constant_values=-np.inf),
+        np.pad(ids, ((0, 0), (0, missing)), constant_values=-1),
+    )
+
+
+def kmeans(
+    vectors: np.ndarray,
+    nlist: int,
+    iterations: int = 15,
+    seed: int = 0,
+    block_rows: int = 8192,
+) -> np.ndarray:
+    """
+    Spherical k-means (cosine) used as the IVF coarse quantizer.
+
+    Assignment runs in row blocks to bound the temporary score matrix.
+
+    Returns:
+        L2-normalized centroids of shape (nlist, dim)
+    """
+    rng = np.random.default_rng(seed)
+    nlist = min(nlist, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign(vectors, centroids, block_rows)
+        counts = np.bincount(assignments, minlength=nlist)
+        order = np.argsort(assignments, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        nonempty = counts > 0
+        sums[nonempty] = np.add.reduceat(vectors[order], starts[nonempty], axis=0)
+
+        # Re-seed empty lists from random points so every list stays useful
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        np.divide(sums, norms, out=sums, where=norms > 0)
+        centroids = sums
+    return centroids.astype(np.float32)
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, block_rows: int = 8192) -> np.ndarray:
+    """Index of the nearest (highest inner product) centroid for each vector."""
+    out = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_rows):
+        block = vectors[start : start + block_rows]
+        out[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+class IVFIndex(FlatIndex):
+    """
+    Inverted-file index: k-means coarse quantizer plus per-centroid id lists.
+
+    A query scans only the lists of its ``nprobe`` closest centroids, so the
+    work per query is roughly ``nprobe / nlist`` of a flat scan. Vectors added
+    after training are appended to their nearest existing list without a
+    retrain; before training the index falls back to a flat scan.
+
+    Recall depends heavily on how clustered the embeddings are. On the
+    benchmark harness's default corpus (``python -m src.core.rag.benchmark
+    --chunks 20000``: 200 Zipf topics, 5-word queries, default nlist=565)
+    recall@10 is 0.47 at nprobe=8 (1.1 ms per query), 0.58 at nprobe=16 and
+    0.79 at nprobe=64 (5.6 ms), against 6.4 ms for a flat scan. Only
+    strongly clustered data (a few dozen narrow topics, 100k vectors,
+    nlist=256) reached ~0.97 at nprobe=8.
+
+    Args:
+        dim: Vector dimensionality
+        nlist: Number of inverted lists; None picks ``4 * sqrt(n)`` at train time
+        nprobe: Default lists scanned per query
+        dtype: Storage dtype, one of ``float32``, ``float16``, ``int8``
+        rerank_factor: Candidates kept per result for exact re-ranking
+        max_train_points: Training sample size for k-means
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        dtype: str = "float32",
+        rerank_factor: int = 4,
+        max_train_points: int = 100_000,
+    ):
+        super().__init__(dim, dtype=dtype, rerank_factor=rerank_factor)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.max_train_points = max_train_points
+        self.centroids: Optional[np.ndarray] = None
+        self._assignments = np.zeros(0, dtype=np.int64)
+        # One id array per list, replaced (never mutated) when rows are added
+        # so concurrent readers always see a complete list
+        self._lists: List[np.ndarray] = []
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def bytes_per_vector(self) -> int:
+        # Each vector also costs its list assignment and one list entry
+        # (both int64)
+        return self.vectors.bytes_per_vector + 2 * self._assignments.itemsize
+
+    @property
+    def nbytes(self) -> int:
+        centroids = 0 if self.centroids is None else self.centroids.nbytes
+        return len(self) * self.bytes_per_vector + centroids
+
+    def train(self, vectors: Optional[np.ndarray] = None, seed: int = 0) -> None:
+        """
+        Fit the coarse quantizer and (re)assign every stored vector.
+
+        Only the training sample and one block of rows at a time are decoded,
+        never a float32 copy of the whole (possibly quantized) corpus.
+
+        Args:
+            vectors: Training sample; defaults to a sample of the stored vectors
+            seed: Random seed for sampling and k-means initialisation
+        """
+        rng = np.random.default_rng(seed)
+        if vectors is None:
+            rows = None
+            if len(self) > self.max_train_points:
+                rows = np.sort(rng.choice(len(self), self.max_train_points, replace=False))
+            vectors = self.vectors.decode(rows)
+        elif len(vectors) > self.max_train_points:
+            vectors = vectors[rng.choice(len(vectors), self.max_train_points, replace=False)]
+        if not len(vectors):
+            return
+        nlist = self.nlist or max(1, int(4 * np.sqrt(len(self))))
+        self.centroids = kmeans(vectors, nlist, seed=seed)
+        self.nlist = len(self.centroids)
+        del vectors
+
+        lists = np.empty(len(self), dtype=np.int64)
+        for start in range(0, len(self), ASSIGN_BLOCK_ROWS):
+            rows = np.arange(start, min(start + ASSIGN_BLOCK_ROWS, len(self)))
+            lists[rows] = assign(self.vectors.decode(rows), self.centroids)
+        self._assignments = np.zeros(0, dtype=np.int64)
+        self._lists = [np.zeros(0, dtype=np.int64) for _ in range(self.nlist)]
+        self._extend_lists(np.arange(len(self)), lists)
+
+    def add(self, vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        start = len(self)
+        self.vectors.add(vectors)
+        if self.trained:
+            self._assign_rows(np.arange(start, len(self)), vectors)
+
+    def list_sizes(self) -> np.ndarray:
+        return np.array([len(ids) for ids in self._lists])
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        exact: Optional[ExactVectors] = None,
+        mask: Optional[np.ndarray] = None,
+        nprobe: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the ``k`` best rows for each query among the probed lists.
+
+        ``mask`` restricts each probed list to masked rows before scoring.
+
+        Returns:
+            ``(scores, ids)`` of shape (nq, k); missing results have id -1
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        if not self.trained:
+            return super().search(queries, k, exact, mask)
+
+        nprobe = self.nprobe if nprobe is None else nprobe
+        if nprobe < 1:
+            raise ValueError(f"nprobe must be at least 1, got {nprobe}")
+        nprobe = min(nprobe, self.nlist)
+        if mask is not None and mask.sum() <= len(self) * nprobe / self.nlist:
+            # A selective filter leaves fewer rows than the probed lists
+            # would hold: scanning them exactly is both cheaper and exact
+            return _pad(*super().search(queries, k, exact, mask), k)
+
+        _, probes = top_k_rows(queries @ self.centroids.T, nprobe)
+        keep = k if self.dtype == "float32" or exact is None else k * self.rerank_factor
+
+        # Visit each probed list once for the whole batch: one matrix product
+        # per list, whose per-query top hits land in that query's candidate slots
+        cand_scores = np.full((len(queries), nprobe * keep), -np.inf, dtype=np.float32)
+        cand_ids = np.full((len(queries), nprobe * keep), -1, dtype=np.int64)
+        filled = np.zeros(len(queries), dtype=np.int64)
+        query_rows = np.repeat(np.arange(len(queries)), probes.shape[1])
+        probe_lists = probes.ravel()
+        order = np.argsort(probe_lists, kind="stable")
+        bounds = np.searchsorted(probe_lists[order], np.arange(self.nlist + 1))
+        for lst in np.unique(probe_lists):
+            rows = self._lists[lst]
+            if mask is not None:
+                rows = rows[mask[rows]]
+            if not len(rows):
+                continue
+            qs = query_rows[order[bounds[lst] : bounds[lst + 1]]]
+            best, cols = top_k_rows(self.vectors.scores(queries[qs], rows), keep)
+            slots = filled[qs, None] + np.arange(best.shape[1])
+            cand_scores[qs[:, None], slots] = best
+            cand_ids[qs[:, None], slots] = rows[cols]
+            filled[qs] += best.shape[1]
+
+        scores, cols = top_k_rows(cand_scores, keep)
+        ids = np.take_along_axis(cand_ids, cols, axis=1)
+        if keep > k:
+            scores, ids = self._rerank_padded(queries, ids, k, exact)
+        return _pad(scores, ids, k)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        state = super().state()
+        if self.trained:
+            state.update(centroids=self.centroids, assignments=self._assignments)
+        return state
+
+    def restore(self, state: Dict[str, np.ndarray]) -> None:
+        super().restore(state)
+        if "centroids" not in state:
+            return
+        self.centroids = state["centroids"]
+        self.nlist = len(self.centroids)
+        self._assignments = state["assignments"].astype(np.int64)
+        order = np.argsort(self._assignments, kind="stable")
+        bounds = np.searchsorted(self._assignments[order], np.arange(self.nlist + 1))
+        self._lists = [order[bounds[lst] : bounds[lst + 1]] for lst in range(self.nlist)]
+
+    def _rerank_padded(self, queries, candidates, k, exact):
+        # Candidate rows can be short (-1 padded) when probed lists are small
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        valid = candidates >= 0
+        if valid.all():
+            return rerank(queries, candidates, k, exact)
+        for q in range(len(queries)):
+            found = candidates[q][valid[q]]
+            if len(found):
+                best, picked = rerank(queries[q : q + 1], found[None, :], k, exact)
+                scores[q, : best.shape[1]] = best[0]
+                ids[q, : best.shape[1]] = picked[0]
+        return scores, ids
+
+    def _assign_rows(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        self._extend_lists(rows, assign(vectors, self.centroids))
+
+    def _extend_lists(self, rows: np.ndarray, lists: np.ndarray) -> None:
+        self._assignments = np.concatenate([self._assignments, lists])
+        order = np.argsort(lists, kind="stable")
+        bounds = np.searchsorted(lists[order], np.arange(self.nlist + 1))
+        for lst in np.unique(lists):
+            added = rows[order[bounds[lst] : bounds[lst + 1]]]
+            self._lists[lst] = np.concatenate([self._lists[lst], added])
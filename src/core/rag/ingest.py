@@ -1,6 +1,7 @@
 # scripts/ingest.py
 
 import argparse
+from src.core.rag.quantization import SUPPORTED_DTYPES
 from src.core.rag.vector_store import VectorStore
 
 
@@ -12,16 +13,57 @@ def main():
         default="vector_store",
         help="Path to persist vector store",
     )
+    parser.add_argument(
+        "--dtype",
+        default="float32",
+        choices=SUPPORTED_DTYPES,
+        help="Vector storage dtype (int8/float16 trade recall for memory)",
+    )
+    parser.add_argument(
+        "--rerank-factor",
+        type=int,
+        default=4,
+        help="Coarse candidates per result re-ranked exactly (compact dtypes)",
+    )
+    parser.add_argument(
+        "--index",
+        default="flat",
+        choices=("flat", "ivf"),
+        help="Exhaustive (flat) or approximate inverted-file (ivf) index",
+    )
+    parser.add_argument(
+        "--nlist",
+        type=int,
+        default=None,
+        help="IVF inverted lists (default: 4 * sqrt(chunks))",
+    )
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        default=8,
+        help="IVF lists scanned per query by default",
+    )
     args = parser.parse_args()
 
     store = VectorStore(
         persist_path=args.store,
+        dtype=args.dtype,
+        rerank_factor=args.rerank_factor,
+        index=args.index,
+        nlist=args.nlist,
+        nprobe=args.nprobe,
     )
 
     store.ingest_directory(args.docs)
 
     print(f"✅ Ingested {store.count()} documents")
     print(f"📦 Vector store saved to: {args.store}")
+    print(
+        f"🗜️  {store.index.dtype}: {store.index.bytes_per_vector} bytes/vector, "
+        f"{store.index.nbytes / 1e6:.1f} MB total"
+    )
+    if args.index == "ivf":
+        print(f"🧭 IVF trained with {store.index.nlist} lists, nprobe={store.index.nprobe}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+"""
+Live document ingestion.
+
+The ``/ingest`` endpoint only validates and enqueues; :class:`IngestionWorker`
+chunks queued documents and indexes them on a worker thread, one atomic
+publish per job, so request handlers and searches never wait on indexing.
+The offline path (``python -m src.core.rag.ingest``) shares the chunker.
+"""
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from src.core.exceptions import ConfigurationError, IngestionError
+from src.core.logger import get_logger
+from src.core.rag.cache import LRUCache
+
+logger = get_logger()
+
+
+def chunk_text(text: str) -> List[str]:
+    """Split on blank lines, dropping empty chunks."""
+    return [chunk.strip() for chunk in text.split("\n\n") if chunk.strip()]
+
+
+@dataclass
+class IngestDocument:
+    text: str
+    source: str = "doc"
+    tags: Optional[List[str]] = None
+
+
+@dataclass
+class IngestJob:
+    # Released once the job finishes; only the count is kept for status
+    documents: Optional[List[IngestDocument]]
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    state: str = "queued"
+    document_count: int = 0
+    chunks: int = 0
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    published_at: Optional[float] = None
+
+    def __post_init__(self):
+        self.document_count = len(self.documents or ())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "state": self.state,
+            "documents": self.document_count,
+            "chunks": self.chunks,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "published_at": self.published_at,
+        }
+
+
+class IngestionWorker:
+    """
+    Background indexer for a copy-on-write store.
+
+    The store's ``add_documents`` runs on a worker thread while searches
+    continue on the event loop, so the store must publish each batch with a
+    single swap (``copy_on_write = True``, as :class:`VectorMemory` does).
+
+    Args:
+        store: Destination store; called from a worker thread
+        max_queue: Jobs that may wait before submissions are rejected
+        max_jobs: Finished jobs remembered for status lookups
+    """
+
+    def __init__(self, store, max_queue: int = 64, max_jobs: int = 1024):
+        if not getattr(store, "copy_on_write", False):
+            raise ConfigurationError(
+                f"{type(store).__name__} is not copy-on-write; "
+                "searches could see a half-written index"
+            )
+        self.store = store
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.documents_indexed = 0
+        self.chunks_indexed = 0
+        self.busy_seconds = 0.0
+        self.last_lag: Optional[float] = None
+        self.max_lag = 0.0
+        self._lag_total = 0.0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._jobs = LRUCache(max_jobs)
+
+    def submit(self, documents: List[IngestDocument]) -> IngestJob:
+        job = IngestJob(documents)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise IngestionError("Ingestion queue is full")
+        self._jobs.put(job.job_id, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self._jobs.get(job_id)
+
+    async def run(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            finally:
+                self._queue.task_done()
+
+    async def drain(self) -> None:
+        """Wait until every queued job has been processed."""
+        await self._queue.join()
+
+    async def _process(self, job: IngestJob) -> None:
+        job.state = "running"
+        start = time.perf_counter()
+        try:
+            job.chunks = await asyncio.to_thread(self._index, job.documents)
+        except Exception as e:
+            logger.exception(f"Ingestion job {job.job_id} failed")
+            job.state = "failed"
+            job.error = str(e)
+            self.jobs_failed += 1
+            return
+        finally:
+            self.busy_seconds += time.perf_counter() - start
+            # Finished jobs stay in the status LRU; their text does not
+            job.documents = None
+
+        job.state = "done"
+        job.published_at = time.time()
+        lag = job.published_at - job.submitted_at
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self._lag_total += lag
+        self.jobs_done += 1
+        self.documents_indexed += job.document_count
+        self.chunks_indexed += job.chunks
+        logger.info(
+            f"Ingested job={job.job_id}: {job.document_count} documents, "
+            f"{job.chunks} chunks, lag={lag * 1000:.1f}ms"
+        )
+
+    def _index(self, documents: List[IngestDocument]) -> int:
+        chunks = [
+            (chunk, doc.source, doc.tags)
+            for doc in documents
+            for chunk in chunk_text(doc.text)
+        ]
+        return self.store.add_documents(chunks)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "jobs_done": self.jobs_done,
+            "jobs_failed": self.jobs_failed,
+            "documents_indexed": self.documents_indexed,
+            "chunks_indexed": self.chunks_indexed,
+            "chunks_per_second": (
+                self.chunks_indexed / self.busy_seconds if self.busy_seconds else 0.0
+            ),
+            # Freshness lag: submission until the chunks are searchable
+            "last_lag_ms": round(self.last_lag * 1000, 3) if self.last_lag is not None else None,
+            "mean_lag_ms": (
+                round(self._lag_total / self.jobs_done * 1000, 3) if self.jobs_done else None
+            ),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+        }
@@ -0,0 +1,186 @@
+"""
+Compact vector storage for the retrieval index.
+
+Vectors can be kept as float32, float16, or int8 codes with one float32
+scale per vector (symmetric scalar quantization). Scoring always works on
+bounded row blocks, so the compact codes are never expanded into a full
+float32 copy of the corpus.
+"""
+import os
+from typing import Optional
+
+import numpy as np
+
+from src.core.exceptions import ConfigurationError
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+# Rows decoded at once while scoring; bounds the temporary float32 buffer
+SCORE_BLOCK_ROWS = 16384
+
+
+class QuantizedMatrix:
+    """Growable row matrix of vectors stored in a compact dtype."""
+
+    def __init__(self, dim: int, dtype: str = "float32"):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ConfigurationError(
+                f"Unsupported vector dtype {dtype!r}, expected one of {SUPPORTED_DTYPES}"
+            )
+        self.dim = dim
+        self.dtype = dtype
+        self._size = 0
+        self._codes = np.zeros((0, dim), dtype=np.dtype(dtype))
+        self._scales: Optional[np.ndarray] = (
+            np.zeros(0, dtype=np.float32) if dtype == "int8" else None
+        )
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._codes[: self._size]
+
+    @property
+    def scales(self) -> Optional[np.ndarray]:
+        return None if self._scales is None else self._scales[: self._size]
+
+    @property
+    def bytes_per_vector(self) -> int:
+        """Storage cost of one vector, including its scale."""
+        per_vector = self.dim * np.dtype(self.dtype).itemsize
+        return per_vector + (4 if self._scales is not None else 0)
+
+    @property
+    def nbytes(self) -> int:
+        return self._size * self.bytes_per_vector
+
+    def add(self, vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        n = len(vectors)
+        self._reserve(self._size + n)
+        if self._scales is None:
+            self._codes[self._size : self._size + n] = vectors
+        else:
+            codes, scales = quantize_int8(vectors)
+            self._codes[self._size : self._size + n] = codes
+            self._scales[self._size : self._size + n] = scales
+        self._size += n
+
+    def decode(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Approximate float32 vectors for ``rows`` (all rows when None)."""
+        codes = self.codes if rows is None else self._codes[rows]
+        out = codes.astype(np.float32)
+        if self._scales is not None:
+            scales = self.scales if rows is None else self._scales[rows]
+            out *= scales[:, None]
+        return out
+
+    def scores(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Approximate inner products between queries and stored vectors.
+
+        Args:
+            queries: float32 array of shape (nq, dim)
+            rows: Optional row ids to restrict scoring to
+
+        Returns:
+            float32 array of shape (nq, len(rows) or len(self))
+        """
+        total = len(self) if rows is None else len(rows)
+        out = np.empty((len(queries), total), dtype=np.float32)
+        for start in range(0, total, SCORE_BLOCK_ROWS):
+            stop = min(start + SCORE_BLOCK_ROWS, total)
+            block = slice(start, stop) if rows is None else rows[start:stop]
+            out[:, start:stop] = queries @ self._codes[block].astype(np.float32).T
+            if self._scales is not None:
+                out[:, start:stop] *= self._scales[block]
+        return out
+
+    @classmethod
+    def from_arrays(
+        cls, codes: np.ndarray, scales: Optional[np.ndarray] = None
+    ) -> "QuantizedMatrix":
+        """Rebuild a matrix from previously stored ``codes`` / ``scales``."""
+        matrix = cls(codes.shape[1], dtype=str(codes.dtype))
+        matrix._codes = np.ascontiguousarray(codes)
+        matrix._size = len(codes)
+        if matrix._scales is not None:
+            matrix._scales = np.asarray(scales, dtype=np.float32)
+        return matrix
+
+    def _reserve(self, size: int) -> None:
+        capacity = len(self._codes)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 64)
+        codes = np.zeros((capacity, self.dim), dtype=self._codes.dtype)
+        codes[: self._size] = self._codes[: self._size]
+        self._codes = codes
+        if self._scales is not None:
+            scales = np.zeros(capacity, dtype=np.float32)
+            scales[: self._size] = self._scales[: self._size]
+            self._scales = scales
+
+
+class OriginalVectors:
+    """
+    Full-precision copies of vectors kept in a compact dtype, read back row
+    by row for exact re-ranking.
+
+    Rows saved to disk are memory-mapped from a ``.npy`` file, so only the
+    candidate rows a query touches are paged in; rows added since the last
+    save live in a growable in-memory float32 matrix.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._saved = np.zeros((0, dim), dtype=np.float32)
+        self._added = QuantizedMatrix(dim, "float32")
+
+    def __len__(self) -> int:
+        return len(self._saved) + len(self._added)
+
+    def add(self, vectors: np.ndarray) -> None:
+        self._added.add(vectors)
+
+    def rows(self, ids: np.ndarray) -> np.ndarray:
+        ids = np.asarray(ids, dtype=np.int64)
+        out = np.empty((len(ids), self.dim), dtype=np.float32)
+        saved = ids < len(self._saved)
+        out[saved] = self._saved[ids[saved]]
+        out[~saved] = self._added.codes[ids[~saved] - len(self._saved)]
+        return out
+
+    def save(self, path: str) -> None:
+        """Write every row to ``path`` and memory-map it from then on."""
+        tmp_path = path + ".tmp"
+        out = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=(len(self), self.dim)
+        )
+        # Copied in blocks: neither part is ever materialized as a whole
+        for start in range(0, len(self), SCORE_BLOCK_ROWS):
+            ids = np.arange(start, min(start + SCORE_BLOCK_ROWS, len(self)))
+            out[ids] = self.rows(ids)
+        out.flush()
+        del out
+        os.replace(tmp_path, path)
+        self.load(path)
+
+    def load(self, path: str) -> None:
+        self._saved = np.load(path, mmap_mode="r")
+        self._added = QuantizedMatrix(self.dim, "float32")
+
+
+def quantize_int8(vectors: np.ndarray):
+    """
+    Symmetric per-vector int8 quantization.
+
+    Returns:
+        ``(codes, scales)`` with ``vectors ~= codes * scales[:, None]``
+    """
+    max_abs = np.abs(vectors).max(axis=1)
+    scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
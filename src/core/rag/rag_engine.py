@@ -1,13 +1,126 @@
-from typing import List, Dict
+import copy
+import time
+from typing import List, Dict, Optional
+
+from src.core.rag.batching import QueryBatcher
+from src.core.rag.cache import QueryEmbeddingCache, RetrievalCache, normalize_query
+from src.core.rag.dedup import mmr_select
+from src.core.rag.embeddings import HashingEmbedder
+from src.core.rag.filters import SearchFilter
 
 
 class RAGEngine:
-    def __init__(self, vector_store):
+    """
+    Builds system-context messages from retrieved documents.
+
+    When a ``cache`` is given and the store exposes a ``generation`` counter,
+    retrievals are memoized until the store next changes. With a ``batcher``
+    the async path (:meth:`abuild_context`) searches concurrent cache misses
+    together. Setting ``mmr_lambda`` fetches ``mmr_pool`` times more
+    candidates and re-ranks them with maximal marginal relevance, so the
+    context is not filled with variations of one passage; on the batched
+    path the re-rank runs on the batch's worker thread, not the event loop.
+
+    Cached results are handed out as copies, so callers may edit the hits
+    they receive without corrupting the cache.
+    """
+
+    def __init__(
+        self,
+        vector_store,
+        top_k: int = 4,
+        cache: Optional[RetrievalCache] = None,
+        batcher: Optional[QueryBatcher] = None,
+        mmr_lambda: Optional[float] = None,
+        mmr_pool: int = 4,
+        embedding_cache_size: int = 1024,
+    ):
         self.vector_store = vector_store
+        self.top_k = top_k
+        self.cache = cache
+        self.batcher = batcher
+        self.mmr_lambda = mmr_lambda
+        self.fetch_k = top_k * mmr_pool if mmr_lambda is not None else top_k
+        self._rerank = self.diversify if mmr_lambda is not None else None
+        # Stores without their own embedder (keyword VectorMemory) use hashing,
+        # with a query-embedding cache of our own for MMR
+        self.embedder = getattr(vector_store, "embedder", None) or HashingEmbedder()
+        self._embed_queries = (
+            getattr(vector_store, "embed_queries", None)
+            or QueryEmbeddingCache(self.embedder, embedding_cache_size).embed
+        )
+
+    def build_context(self, query: str, filters: Optional[SearchFilter] = None) -> List[Dict]:
+        if not query.strip():
+            return []
+        return _context_messages(self.retrieve(query, filters))
+
+    async def abuild_context(
+        self, query: str, filters: Optional[SearchFilter] = None
+    ) -> List[Dict]:
+        if not query.strip():
+            return []
+        return _context_messages(await self.aretrieve(query, filters))
+
+    def retrieve(self, query: str, filters: Optional[SearchFilter] = None) -> List:
+        generation = getattr(self.vector_store, "generation", None)
+        if self.cache is None or generation is None:
+            docs = self.vector_store.search(query, self.fetch_k, filters=filters)
+            return self.diversify(query, docs)
+
+        key = (normalize_query(query), self.top_k, filters)
+        docs = self.cache.get(key, generation)
+        if docs is None:
+            start = time.perf_counter()
+            docs = self.vector_store.search(query, self.fetch_k, filters=filters)
+            docs = tuple(self.diversify(query, docs))
+            self.cache.put(key, generation, docs, seconds=time.perf_counter() - start)
+        return _detached(docs)
+
+    async def aretrieve(self, query: str, filters: Optional[SearchFilter] = None) -> List:
+        if self.batcher is None:
+            return self.retrieve(query, filters)
+
+        generation = getattr(self.vector_store, "generation", None)
+        if self.cache is None or generation is None:
+            return await self.batcher.search(query, self.fetch_k, filters, rerank=self._rerank)
+
+        key = (normalize_query(query), self.top_k, filters)
+        docs = self.cache.get(key, generation)
+        if docs is None:
+            start = time.perf_counter()
+            docs = await self.batcher.search(
+                query, self.fetch_k, filters, rerank=self._rerank
+            )
+            docs = tuple(docs)
+            # Keyed on the generation read before searching: a concurrent
+            # write makes this entry stale rather than wrongly fresh
+            self.cache.put(key, generation, docs, seconds=time.perf_counter() - start)
+        return _detached(docs)
+
+    def diversify(self, query: str, docs: List) -> List:
+        """MMR re-rank of the candidate pool down to ``top_k`` (no-op when off)."""
+        if self.mmr_lambda is None or len(docs) <= 1:
+            return list(docs)[: self.top_k]
+        # Candidates embedded in one call, scored in one product
+        candidates = self.embedder.embed([doc_text(doc) for doc in docs])
+        query_vector = self._embed_queries([query])[0]
+        picked = mmr_select(query_vector, candidates, self.top_k, self.mmr_lambda)
+        return [docs[i] for i in picked]
+
+
+def _detached(docs) -> List:
+    # Hit dicts (and their tag lists) are copied; strings are immutable
+    return [doc if isinstance(doc, str) else copy.deepcopy(doc) for doc in docs]
+
+
+def _context_messages(docs: List) -> List[Dict]:
+    return [
+        {"role": "system", "content": f"Context:\n{doc_text(doc)}"}
+        for doc in docs
+    ]
+
 
-    def build_context(self, query: str) -> List[Dict]:
-        docs = self.vector_store.search(query, k=4)
-        return [
-            {"role": "system", "content": f"Context:\n{doc}"}
-            for doc in docs
-        ]
\ No newline at end of file
+def doc_text(doc) -> str:
+    # VectorMemory returns plain strings, VectorStore returns hit dicts
+    return doc if isinstance(doc, str) else doc["text"]
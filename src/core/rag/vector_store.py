@@ -1,12 +1,346 @@
+import json
+import os
+from typing import Dict, List, Optional
+
 import numpy as np
-from typing import List
+
+from src.core.exceptions import ConfigurationError
+from src.core.logger import get_logger
+from src.core.rag.cache import QueryEmbeddingCache
+from src.core.rag.dedup import DEFAULT_MAX_DISTANCE, collapse_near_duplicates, simhash_many
+from src.core.rag.embeddings import load_embedder
+from src.core.rag.evaluation import recall_at_k
+from src.core.rag.filters import MetadataIndex, SearchFilter
+from src.core.rag.ingestion import chunk_text
+from src.core.rag.index import FlatIndex, IVFIndex, top_k_rows
+from src.core.rag.quantization import SCORE_BLOCK_ROWS, OriginalVectors, QuantizedMatrix
+
+logger = get_logger()
+
+DOC_EXTENSIONS = (".txt", ".md")
+# Extra candidates fetched per result so collapsed near-duplicates can be replaced
+DEDUP_OVERFETCH = 3
+# Full-precision vectors of compact stores, memory-mapped for re-ranking
+ORIGINALS_FILE = "originals.npy"
 
 
 class VectorStore:
-    def __init__(self, backend=None):
+    """
+    Embedding-based document store for RAG.
+
+    Args:
+        backend: Optional external backend (Redis / FAISS) to delegate search to
+        persist_path: Directory to load from / save to; None keeps it in memory
+        embedding_model: Embedder name (see ``load_embedder``) or instance
+        dtype: Vector storage dtype: ``float32``, ``float16`` or ``int8``
+        rerank_factor: Coarse candidates per result re-ranked exactly when
+            vectors are stored in a compact dtype
+        index: ``flat`` (exhaustive) or ``ivf`` (approximate, sub-linear)
+        nlist: IVF inverted lists; None sizes them from the corpus at train time
+        nprobe: Default IVF lists scanned per query
+        embedding_cache_size: Query embeddings kept in an LRU cache
+        near_duplicate_distance: SimHash bit distance at which results are
+            collapsed as near-duplicates; None disables collapsing
+
+    ``generation`` increases on every change to the indexed contents, which
+    lets caches in front of the store detect stale results. Writes mutate
+    the index in place, so they must not overlap searches.
+    """
+
+    copy_on_write = False
+
+    def __init__(
+        self,
+        backend=None,
+        persist_path: Optional[str] = None,
+        embedding_model="hashing",
+        dtype: str = "float32",
+        rerank_factor: int = 4,
+        index: str = "flat",
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        embedding_cache_size: int = 1024,
+        near_duplicate_distance: Optional[int] = DEFAULT_MAX_DISTANCE,
+    ):
         self.backend = backend  # Redis / FAISS injected later
+        self.persist_path = persist_path
+        self.embedder = load_embedder(embedding_model)
+        if index == "flat":
+            self.index = FlatIndex(self.embedder.dim, dtype=dtype, rerank_factor=rerank_factor)
+        elif index == "ivf":
+            self.index = IVFIndex(
+                self.embedder.dim,
+                nlist=nlist,
+                nprobe=nprobe,
+                dtype=dtype,
+                rerank_factor=rerank_factor,
+            )
+        else:
+            raise ConfigurationError(f"Unknown index type: {index}")
+        # Compact dtypes re-rank against the float32 originals (float32
+        # storage is its own exact source)
+        self._originals = OriginalVectors(self.embedder.dim) if dtype != "float32" else None
+        self._docs: List[Dict] = []
+        # SimHash per chunk, computed at ingest (see src.core.rag.dedup), in
+        # a buffer grown by doubling so small adds stay amortized O(1)
+        self._fingerprints = np.zeros(0, dtype=np.uint64)
+        self._fingerprint_count = 0
+        self.near_duplicate_distance = near_duplicate_distance
+        self.metadata = MetadataIndex()
+        self.generation = 0
+        self._query_embeddings = QueryEmbeddingCache(self.embedder, embedding_cache_size)
+
+        if persist_path and os.path.exists(os.path.join(persist_path, "documents.json")):
+            self.load()
+
+    def count(self) -> int:
+        return len(self._docs)
+
+    def add(self, text: str, source: str = "doc", tags: Optional[List[str]] = None) -> None:
+        self.add_texts([text], sources=[source], tags=[tags] if tags else None)
+
+    def add_texts(
+        self,
+        texts: List[str],
+        sources: Optional[List[str]] = None,
+        tags: Optional[List[Optional[List[str]]]] = None,
+    ) -> None:
+        sources = sources or ["doc"] * len(texts)
+        tags = tags or [None] * len(texts)
+        vectors = self.embedder.embed(texts)
+        self.index.add(vectors)
+        if self._originals is not None:
+            self._originals.add(vectors)
+        self._append_fingerprints(simhash_many(texts))
+        for text, source, doc_tags in zip(texts, sources, tags):
+            doc = {"text": text, "source": source}
+            if doc_tags:
+                doc["tags"] = list(doc_tags)
+            self._docs.append(doc)
+            self.metadata.add(source, doc_tags)
+        self.generation += 1
+
+    def add_documents(self, documents) -> int:
+        """
+        Index ``(text, source, tags)`` chunks; returns how many were added.
+
+        Rows, documents and metadata are updated in place, so this must not
+        run concurrently with searches (this store is not a valid
+        :class:`IngestionWorker` target).
+        """
+        documents = list(documents)
+        if documents:
+            texts, sources, tags = (list(column) for column in zip(*documents))
+            self.add_texts(texts, sources, tags)
+        return len(documents)
+
+    def ingest_directory(self, path: str) -> int:
+        """
+        Chunk and index every text/markdown file in ``path``.
+
+        Returns:
+            Number of chunks added
+        """
+        texts, sources = [], []
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(DOC_EXTENSIONS):
+                continue
+            with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                text = f.read()
+            for chunk in chunk_text(text):
+                texts.append(chunk)
+                sources.append(name)
+
+        if texts:
+            self.add_texts(texts, sources)
+        if isinstance(self.index, IVFIndex) and not self.index.trained:
+            self.train()
+        if self.persist_path:
+            self.save()
+        return len(texts)
+
+    def train(self) -> None:
+        """
+        Fit the IVF coarse quantizer on the stored vectors (offline step).
+
+        Documents added afterwards join their nearest list without a retrain;
+        retrain when the corpus has grown or drifted substantially.
+        """
+        if isinstance(self.index, IVFIndex):
+            self.index.train()
+            self.generation += 1
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 4,
+        nprobe: Optional[int] = None,
+        filters: Optional[SearchFilter] = None,
+    ) -> List[Dict]:
+        return self.search_batch([query], top_k, nprobe=nprobe, filters=filters)[0]
+
+    def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 4,
+        nprobe: Optional[int] = None,
+        filters: Optional[SearchFilter] = None,
+    ) -> List[List[Dict]]:
+        """
+        Search several queries sharing ``top_k`` and ``filters`` at once.
+
+        The queries are embedded in one call and scored with a single
+        matrix-matrix product against the index.
+        """
+        if self.backend:
+            if filters is not None and not filters.empty:
+                # External backends do not see the metadata index
+                raise ConfigurationError("Metadata filters are not supported with a backend")
+            return [self.backend.search(query, top_k) for query in queries]
+        results: List[List[Dict]] = [[] for _ in queries]
+        live = [i for i, query in enumerate(queries) if query.strip()]
+        if not live or not self._docs:
+            return results
+
+        mask = self.metadata.mask(filters)
+        if mask is not None and not mask.any():
+            return results
+        dedupe = self.near_duplicate_distance is not None
+        fetch = top_k * DEDUP_OVERFETCH if dedupe else top_k
+        vectors = self.embed_queries([queries[i] for i in live])
+        scores, ids = self._search_vectors(vectors, fetch, nprobe, mask)
+        for row, i in enumerate(live):
+            valid = (ids[row] >= 0) & (scores[row] > 0)
+            row_ids, row_scores = ids[row][valid], scores[row][valid]
+            if dedupe:
+                keep = collapse_near_duplicates(
+                    self._fingerprints[row_ids], self.near_duplicate_distance
+                )
+                row_ids, row_scores = row_ids[keep], row_scores[keep]
+            results[i] = [
+                {**self._docs[doc], "score": float(score)}
+                for score, doc in zip(row_scores[:top_k], row_ids[:top_k])
+            ]
+        return results
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embed a single query (shape (1, dim)), reusing cached embeddings."""
+        return self.embed_queries([query])
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed queries (shape (n, dim)); cache misses are embedded together."""
+        return self._query_embeddings.embed(queries)
+
+    def quantization_report(self, queries: List[str], k: int = 4) -> Dict:
+        """
+        Compare the configured storage dtype against exact float32 search.
+
+        Returns:
+            Storage cost per vector and recall@k of the compact index
+        """
+        query_vectors = self.embedder.embed(queries)
+        exact = self._exact_vectors(np.arange(self.count()))
+        exact_scores = query_vectors @ exact.T
+        _, expected = top_k_rows(exact_scores, k)
+        _, retrieved = self._search_vectors(query_vectors, k)
+        float32_bytes = self.index.dim * 4
+        return {
+            "dtype": self.index.dtype,
+            "vectors": self.count(),
+            "bytes_per_vector": self.index.bytes_per_vector,
+            "float32_bytes_per_vector": float32_bytes,
+            "compression": float32_bytes / self.index.bytes_per_vector,
+            "rerank_factor": self.index.rerank_factor,
+            f"recall@{k}": recall_at_k(retrieved, expected, exact_scores),
+        }
+
+    def save(self) -> None:
+        os.makedirs(self.persist_path, exist_ok=True)
+        with open(os.path.join(self.persist_path, "documents.json"), "w", encoding="utf-8") as f:
+            json.dump(self._docs, f)
+        np.savez(
+            os.path.join(self.persist_path, "vectors.npz"),
+            fingerprints=self._fingerprints[: self._fingerprint_count],
+            **self.index.state(),
+        )
+        if self._originals is not None:
+            self._originals.save(os.path.join(self.persist_path, ORIGINALS_FILE))
+
+    def load(self) -> None:
+        with open(os.path.join(self.persist_path, "documents.json"), "r", encoding="utf-8") as f:
+            self._docs = json.load(f)
+        self.metadata = MetadataIndex()
+        for doc in self._docs:
+            self.metadata.add(doc["source"], doc.get("tags"))
+        self.generation += 1
+        with np.load(os.path.join(self.persist_path, "vectors.npz")) as data:
+            state = dict(data)
+        fingerprints = state.pop("fingerprints", None)
+        if fingerprints is None:
+            # Stores saved before fingerprints existed
+            fingerprints = simhash_many([doc["text"] for doc in self._docs])
+        self._fingerprints = fingerprints.astype(np.uint64)
+        self._fingerprint_count = len(self._fingerprints)
+
+        stored = QuantizedMatrix.from_arrays(state["codes"], state.get("scales"))
+        originals_path = os.path.join(self.persist_path, ORIGINALS_FILE)
+        if stored.dtype != self.index.dtype:
+            logger.warning(
+                f"Converting stored {stored.dtype} vectors to {self.index.dtype} "
+                f"({self.persist_path})"
+            )
+            converted = QuantizedMatrix(self.index.dim, self.index.dtype)
+            self._copy_rows(self._full_precision(stored, originals_path), converted)
+            state.pop("scales", None)
+            state["codes"] = converted.codes
+            if converted.scales is not None:
+                state["scales"] = converted.scales
+        if self._originals is not None:
+            self._originals = OriginalVectors(self.index.dim)
+            if os.path.exists(originals_path):
+                self._originals.load(originals_path)
+            else:
+                # Kept in memory until the next save writes them out
+                self._copy_rows(self._full_precision(stored, originals_path), self._originals)
+        self.index.restore(state)
+
+    def _full_precision(self, stored: QuantizedMatrix, originals_path: str) -> np.ndarray:
+        """Best available float32 source for the stored rows."""
+        if os.path.exists(originals_path):
+            return np.load(originals_path, mmap_mode="r")
+        if stored.dtype == "float32":
+            return stored.codes
+        # Compact stores saved before originals were kept: embed once more
+        return self.embedder.embed([doc["text"] for doc in self._docs])
+
+    @staticmethod
+    def _copy_rows(source: np.ndarray, destination) -> None:
+        for start in range(0, len(source), SCORE_BLOCK_ROWS):
+            destination.add(np.asarray(source[start : start + SCORE_BLOCK_ROWS]))
+
+    def _append_fingerprints(self, fingerprints: np.ndarray) -> None:
+        size = self._fingerprint_count + len(fingerprints)
+        if size > len(self._fingerprints):
+            grown = np.zeros(max(size, len(self._fingerprints) * 2, 64), dtype=np.uint64)
+            grown[: self._fingerprint_count] = self._fingerprints[: self._fingerprint_count]
+            self._fingerprints = grown
+        self._fingerprints[self._fingerprint_count : size] = fingerprints
+        self._fingerprint_count = size
+
+    def _search_vectors(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        mask: Optional[np.ndarray] = None,
+    ):
+        if isinstance(self.index, IVFIndex):
+            return self.index.search(
+                queries, k, exact=self._exact_vectors, mask=mask, nprobe=nprobe
+            )
+        return self.index.search(queries, k, exact=self._exact_vectors, mask=mask)
 
-    def search(self, query: str, k: int = 4) -> List[str]:
-        if not self.backend:
-            return []
-        return self.backend.search(query, k)
\ No newline at end of file
+    def _exact_vectors(self, ids: np.ndarray) -> np.ndarray:
+        if self._originals is None:
+            return self.index.vectors.decode(ids)
+        return self._originals.rows(ids)
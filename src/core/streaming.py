@@ -0,0 +1,501 @@
+"""
+Resumable SSE streams backed by bounded per-stream replay buffers.
+
+Each chat generation runs in its own producer task that writes numbered
+events into a ring buffer. HTTP responses subscribe to that buffer instead
+of consuming the upstream generator directly, so a client whose connection
+drops can reconnect with ``Last-Event-ID`` and replay what it missed rather
+than paying for a brand new upstream generation.
+
+Event ids have the form ``<stream_id>:<seq>`` so the standard SSE
+``Last-Event-ID`` header is enough to locate both the stream and the
+position to resume from.
+"""
+import asyncio
+import itertools
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from src.core.exceptions import StreamError
+from src.core.logger import get_logger
+
+logger = get_logger()
+
+# Rough per-event bookkeeping cost on top of the payload itself
+EVENT_OVERHEAD_BYTES = 64
+
+
+@dataclass(frozen=True)
+class StreamEvent:
+    """A single numbered SSE event."""
+
+    seq: int
+    event: str
+    data: str
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.event) + len(self.data) + EVENT_OVERHEAD_BYTES
+
+
+def format_sse(stream_id: str, event: StreamEvent) -> str:
+    """Render an event in SSE wire format, including its resumable id."""
+    return f"id: {stream_id}:{event.seq}\nevent: {event.event}\ndata: {event.data}\n\n"
+
+
+def parse_last_event_id(value: str) -> Optional[Tuple[str, int]]:
+    """
+    Split a ``Last-Event-ID`` header into ``(stream_id, seq)``.
+
+    Returns None when the value was not produced by this module.
+    """
+    stream_id, sep, seq = value.strip().rpartition(":")
+    if not sep or not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+
+class ReplayBuffer:
+    """
+    Bounded ring buffer of numbered events for one stream.
+
+    Sequence numbers start at 1 and are never reused, so a subscriber can
+    always tell whether the events it needs are still buffered.
+    """
+
+    def __init__(self, max_events: int):
+        self.max_events = max_events
+        self.nbytes = 0
+        self.closed = False
+        self._events: Deque[StreamEvent] = deque()
+        self._next_seq = 1
+        self._changed = asyncio.Event()
+
+    @property
+    def first_seq(self) -> int:
+        """Sequence number of the oldest event still buffered."""
+        return self._events[0].seq if self._events else self._next_seq
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the newest event (0 when nothing was written)."""
+        return self._next_seq - 1
+
+    def append(self, event: str, data: str) -> int:
+        """
+        Append an event and wake subscribers.
+
+        Returns:
+            Net change in buffered bytes (negative when the ring evicted).
+        """
+        item = StreamEvent(self._next_seq, event, data)
+        self._next_seq += 1
+        self._events.append(item)
+        delta = item.nbytes
+        while len(self._events) > self.max_events:
+            delta -= self._events.popleft().nbytes
+        self.nbytes += delta
+        self._notify()
+        return delta
+
+    def drop_oldest(self) -> int:
+        """Evict the oldest event, returning the number of bytes freed."""
+        if not self._events:
+            return 0
+        freed = self._events.popleft().nbytes
+        self.nbytes -= freed
+        return freed
+
+    def close(self) -> None:
+        """Mark the stream as complete; subscribers drain and stop."""
+        self.closed = True
+        self._notify()
+
+    def covers(self, after_seq: int) -> bool:
+        """Whether every event after ``after_seq`` is still available."""
+        return self.first_seq <= after_seq + 1 and after_seq <= self.last_seq
+
+    async def follow(self, after_seq: int) -> AsyncIterator[StreamEvent]:
+        """Yield buffered events after ``after_seq``, then live ones until closed."""
+        while True:
+            if after_seq + 1 < self.first_seq:
+                raise StreamError(
+                    f"Replay buffer overrun: event {after_seq + 1} was evicted"
+                )
+            start = after_seq + 1 - self.first_seq
+            for item in list(itertools.islice(self._events, start, None)):
+                yield item
+                after_seq = item.seq
+
+            waiter = self._changed
+            if self.last_seq > after_seq:
+                continue
+            if self.closed:
+                return
+            await waiter.wait()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class ResumableStream:
+    """
+    One upstream generation shared by any number of (re)connecting clients.
+
+    The producer keeps running while no client is attached for up to
+    ``grace_seconds``; after that the generation is cancelled and whatever
+    text was produced is handed to ``on_complete``. With a grace period of
+    zero the generation is cancelled as soon as the last client detaches.
+    Cancellation interrupts the producer task directly, so it does not wait
+    for the next upstream token and the upstream HTTP stream is closed
+    immediately.
+    """
+
+    def __init__(
+        self,
+        stream_id: str,
+        session_id: str,
+        registry: "StreamRegistry",
+        max_events: int,
+        grace_seconds: float,
+    ):
+        self.stream_id = stream_id
+        self.session_id = session_id
+        self.grace_seconds = grace_seconds
+        self.buffer = ReplayBuffer(max_events)
+        self.subscribers = 0
+        # Streamed token events; upstream deltas may carry several tokens each
+        self.tokens = 0
+        self.completed = False
+        self.created_at = time.monotonic()
+        self._first_token_at: Optional[float] = None
+        self._cancel_requested_at: Optional[float] = None
+        self._max_tokens: Optional[int] = None
+        self._registry = registry
+        self._producer: Optional[asyncio.Task] = None
+        self._grace_timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def running(self) -> bool:
+        return self._producer is not None and not self._producer.done()
+
+    def start(
+        self,
+        source: AsyncIterator[Dict[str, Any]],
+        on_complete: Callable[[str], None],
+        max_tokens: Optional[int] = None,
+    ) -> None:
+        """
+        Begin consuming ``source`` (a ``stream_agent`` generator) in the background.
+
+        Args:
+            source: Async iterator of agent events
+            on_complete: Called with the generated text once the producer stops
+            max_tokens: Generation budget, an upper bound on what cancelling saved
+        """
+        self._max_tokens = max_tokens
+        self._producer = asyncio.create_task(self._produce(source, on_complete))
+
+    def add_done_callback(self, callback: Callable[[], None]) -> None:
+        """Call ``callback`` once the producer has stopped, however it ended."""
+        self._producer.add_done_callback(lambda _: callback())
+
+    def cancel(self) -> None:
+        """Stop the upstream generation if it is still running."""
+        if self.running:
+            if self._cancel_requested_at is None:
+                self._cancel_requested_at = time.monotonic()
+            self._producer.cancel()
+
+    async def subscribe(self, after_seq: int = 0) -> AsyncIterator[StreamEvent]:
+        """Attach a client and yield events after ``after_seq`` until the stream ends."""
+        self._attach()
+        try:
+            async for item in self.buffer.follow(after_seq):
+                yield item
+        finally:
+            self._detach()
+
+    def _publish(self, event: str, data: str) -> None:
+        self._registry._account(self.buffer.append(event, data))
+
+    async def _produce(
+        self,
+        source: AsyncIterator[Dict[str, Any]],
+        on_complete: Callable[[str], None],
+    ) -> None:
+        parts = []
+        self._publish("start", "{}")
+        try:
+            async for event in source:
+                if event["type"] == "token":
+                    if self._first_token_at is None:
+                        self._first_token_at = time.monotonic()
+                    self.tokens += 1
+                    parts.append(event["data"])
+                    self._publish("token", event["data"])
+                elif event["type"] == "done":
+                    break
+            self._publish("done", "{}")
+            self.completed = True
+        except asyncio.CancelledError:
+            logger.info(
+                f"Stream abandoned stream={self.stream_id}, session={self.session_id}, "
+                f"tokens={self.tokens}"
+            )
+            self._registry._cancelled(self)
+            raise
+        except Exception as e:
+            logger.exception("Unexpected SSE error")
+            self._publish("error", str(e))
+        finally:
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            text = "".join(parts)
+            if text:
+                on_complete(text)
+            self.buffer.close()
+            self._registry._finished(self)
+
+    def savings_estimate(self, expected_tokens: Optional[float]) -> Tuple[float, float]:
+        """
+        Estimate the upstream work avoided by cancelling now.
+
+        Args:
+            expected_tokens: Mean length (in token events) of generations
+                that ran to completion, or None if none has yet
+
+        Returns:
+            ``(tokens_saved, seconds_saved)``: how far this generation was
+            short of the mean, and that many events at its observed rate.
+            Zero when there is no mean yet or the generation already
+            exceeded it.
+        """
+        if expected_tokens is None:
+            return 0.0, 0.0
+        remaining = max(expected_tokens - self.tokens, 0.0)
+        if self._first_token_at is None or self.tokens < 2:
+            return remaining, 0.0
+        elapsed = time.monotonic() - self._first_token_at
+        seconds_per_token = elapsed / (self.tokens - 1)
+        return remaining, remaining * seconds_per_token
+
+    def max_tokens_avoided(self) -> int:
+        """Token budget left unused: an upper bound on the tokens saved."""
+        if self._max_tokens is None:
+            return 0
+        return max(self._max_tokens - self.tokens, 0)
+
+    def _attach(self) -> None:
+        self.subscribers += 1
+        if self._grace_timer is not None:
+            self._grace_timer.cancel()
+            self._grace_timer = None
+
+    def _detach(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers > 0 or not self.running:
+            return
+        if self.grace_seconds <= 0:
+            self.cancel()
+            return
+        loop = asyncio.get_running_loop()
+        self._grace_timer = loop.call_later(self.grace_seconds, self._grace_expired)
+
+    def _grace_expired(self) -> None:
+        self._grace_timer = None
+        if self.subscribers == 0:
+            logger.info(f"Resume grace period expired stream={self.stream_id}")
+            self.cancel()
+
+
+class StreamRegistry:
+    """
+    Owns all live and recently finished streams.
+
+    Finished streams stay resumable for ``grace_seconds``. Total buffered
+    bytes across every stream are capped at ``max_bytes``: finished,
+    unattended streams are evicted first, then the oldest events of the
+    largest buffers.
+    """
+
+    def __init__(self, max_events: int, max_bytes: int, grace_seconds: float):
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self.total_bytes = 0
+        self.resumed = 0
+        self.evicted_streams = 0
+        self.trimmed_events = 0
+        self.cancelled = 0
+        self.completed = 0
+        self.tokens_saved = 0.0
+        self.upstream_seconds_saved = 0.0
+        self.max_tokens_avoided = 0
+        self._completed_tokens = 0
+        self.max_cancel_latency = 0.0
+        self._streams: "OrderedDict[str, ResumableStream]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def create(self, session_id: str) -> ResumableStream:
+        stream_id = uuid.uuid4().hex
+        stream = ResumableStream(
+            stream_id,
+            session_id,
+            registry=self,
+            max_events=self.max_events,
+            grace_seconds=self.grace_seconds,
+        )
+        self._streams[stream_id] = stream
+        return stream
+
+    def get(self, stream_id: str) -> Optional[ResumableStream]:
+        return self._streams.get(stream_id)
+
+    def resume(
+        self, last_event_id: str, session_id: Optional[str] = None
+    ) -> Optional[Tuple[ResumableStream, int]]:
+        """
+        Locate the stream a ``Last-Event-ID`` refers to.
+
+        Returns:
+            ``(stream, after_seq)`` when the stream still holds every event
+            after ``after_seq``, otherwise None (the caller should start a
+            fresh generation).
+        """
+        parsed = parse_last_event_id(last_event_id)
+        if parsed is None:
+            return None
+        stream_id, after_seq = parsed
+        stream = self._streams.get(stream_id)
+        if stream is None or not stream.buffer.covers(after_seq):
+            return None
+        if session_id is not None and session_id != stream.session_id:
+            return None
+        self.resumed += 1
+        return stream, after_seq
+
+    def discard(self, stream_id: str) -> None:
+        """Forget a stream, cancelling its generation if still running."""
+        stream = self._remove(stream_id)
+        if stream is not None:
+            stream.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "streams": len(self._streams),
+            "running": sum(1 for s in self._streams.values() if s.running),
+            "buffered_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "resumed": self.resumed,
+            "evicted_streams": self.evicted_streams,
+            "trimmed_events": self.trimmed_events,
+            "cancelled": self.cancelled,
+            "completed": self.completed,
+            "mean_completion_tokens": (
+                round(self._completed_tokens / self.completed, 1) if self.completed else None
+            ),
+            # Estimated from the mean completed length; max_tokens_avoided is
+            # the (usually loose) upper bound from the configured budget
+            "tokens_saved": round(self.tokens_saved, 1),
+            "upstream_seconds_saved": round(self.upstream_seconds_saved, 3),
+            "max_tokens_avoided": self.max_tokens_avoided,
+            "max_cancel_latency_ms": round(self.max_cancel_latency * 1000, 3),
+        }
+
+    def _account(self, delta: int) -> None:
+        self.total_bytes += delta
+        if self.total_bytes > self.max_bytes:
+            self._enforce_cap()
+
+    def _enforce_cap(self) -> None:
+        # Oldest finished streams nobody is reading are the cheapest to lose
+        for stream_id, stream in list(self._streams.items()):
+            if self.total_bytes <= self.max_bytes:
+                return
+            if stream.buffer.closed and stream.subscribers == 0:
+                self.discard(stream_id)
+                self.evicted_streams += 1
+
+        while self.total_bytes > self.max_bytes and self._streams:
+            largest = max(self._streams.values(), key=lambda s: s.buffer.nbytes)
+            freed = largest.buffer.drop_oldest()
+            if not freed:
+                break
+            self.total_bytes -= freed
+            self.trimmed_events += 1
+
+    def _cancelled(self, stream: ResumableStream) -> None:
+        expected = self._completed_tokens / self.completed if self.completed else None
+        tokens_saved, seconds_saved = stream.savings_estimate(expected)
+        self.cancelled += 1
+        self.tokens_saved += tokens_saved
+        self.upstream_seconds_saved += seconds_saved
+        self.max_tokens_avoided += stream.max_tokens_avoided()
+        if stream._cancel_requested_at is not None:
+            latency = time.monotonic() - stream._cancel_requested_at
+            self.max_cancel_latency = max(self.max_cancel_latency, latency)
+
+    def _remove(self, stream_id: str) -> Optional[ResumableStream]:
+        stream = self._streams.pop(stream_id, None)
+        if stream is not None:
+            self.total_bytes -= stream.buffer.nbytes
+        return stream
+
+    def _finished(self, stream: ResumableStream) -> None:
+        if stream.completed:
+            self.completed += 1
+            self._completed_tokens += stream.tokens
+        if self.grace_seconds <= 0:
+            self._remove(stream.stream_id)
+            return
+        loop = asyncio.get_running_loop()
+        loop.call_later(self.grace_seconds, self._remove, stream.stream_id)
+
+
+async def wait_for_disconnect(request: Any) -> None:
+    """Return once the ASGI server reports that the client went away."""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def until_disconnected(
+    events: AsyncIterator[StreamEvent], request: Any
+) -> AsyncIterator[StreamEvent]:
+    """
+    Relay ``events`` until the client disconnects.
+
+    A watcher task listens for ``http.disconnect`` alongside the pending
+    event, so a disconnect is acted on immediately instead of when the next
+    upstream token happens to arrive. The pending read is cancelled, which
+    detaches the subscriber from its stream right away.
+    """
+    watcher = asyncio.create_task(wait_for_disconnect(request))
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            pending = asyncio.ensure_future(events.__anext__())
+            done, _ = await asyncio.wait(
+                {pending, watcher}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if pending not in done:
+                return
+            try:
+                item = pending.result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        watcher.cancel()
+        if pending is not None and not pending.done():
+            pending.cancel()
+            await asyncio.wait({pending})
@@ -7,21 +7,37 @@ FastAPI application for AI coding agent backend.
 - Secure API key auth
 """
 
+import asyncio
+import time
 import uuid
-from contextlib import asynccontextmanager
-from typing import Dict
+from contextlib import aclosing, asynccontextmanager
+from typing import Dict, Literal
 
-from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
 from src.agent.deepseek import stream_agent
 from src.core.config import init_settings
+from src.core.exceptions import IngestionError
 from src.core.logger import get_logger
+from src.core.memory.prompt_assembler import PromptAssembler
 from src.core.memory.short_term import ShortTermMemory
+from src.core.memory.snapshot import SessionSnapshotStore, SessionSnapshotter
 from src.core.memory.vector_memory import VectorMemory
-from src.core.rag.rag_engine import RAGEngine
+from src.core.profiling import Profiler, RequestProfile, span
+from src.core.rag.batching import QueryBatcher
+from src.core.rag.cache import RetrievalCache
+from src.core.rag.filters import SearchFilter
+from src.core.rag.ingestion import IngestDocument, IngestionWorker
+from src.core.rag.rag_engine import RAGEngine, doc_text
+from src.core.streaming import (
+    ResumableStream,
+    StreamRegistry,
+    format_sse,
+    until_disconnected,
+)
 
 # ---------------------------------------------------------------------
 # Settings & Logger
@@ -40,7 +56,25 @@ async def lifespan(app: FastAPI):
     logger.info(f"Model: {settings.model_name}")
     logger.info(f"Temperature: {settings.model_temperature}")
     logger.info(f"Max Tokens: {settings.model_max_tokens}")
+
+    ingest_task = asyncio.create_task(ingestion_worker.run())
+
+    snapshot_task = None
+    if snapshotter:
+        logger.info(f"Session snapshots: {settings.session_snapshot_dir}")
+        snapshot_task = asyncio.create_task(snapshotter.run())
+
     yield
+
+    if snapshot_task:
+        snapshot_task.cancel()
+        # Let an in-flight flush finish first, or the final flush could
+        # write the same records again
+        await asyncio.gather(snapshot_task, return_exceptions=True)
+        written = await snapshotter.flush()
+        logger.info(f"Flushed {written} session snapshots")
+    ingest_task.cancel()
+    profiler.disable()
     logger.info("Shutting down AI Coding Agent Backend")
 
 # ---------------------------------------------------------------------
@@ -67,31 +101,194 @@ app.add_middleware(
 # ---------------------------------------------------------------------
 
 # Long-term vector store (RAG)
-vector_memory = VectorMemory()
-rag_engine = RAGEngine(vector_memory)
+vector_memory = VectorMemory(near_duplicate_distance=settings.rag_near_duplicate_bits)
+rag_cache = RetrievalCache(settings.rag_cache_size) if settings.rag_cache_size else None
+# Concurrent retrievals are searched together (a batch size of 1 disables it)
+rag_batcher = (
+    QueryBatcher(
+        vector_memory,
+        max_wait=settings.rag_batch_max_wait_ms / 1000,
+        max_batch_size=settings.rag_batch_max_size,
+    )
+    if settings.rag_batch_max_size > 1
+    else None
+)
+rag_engine = RAGEngine(
+    vector_memory,
+    cache=rag_cache,
+    batcher=rag_batcher,
+    mmr_lambda=settings.rag_mmr_lambda,
+)
+
+# Background indexer for /ingest; publishes into vector_memory copy-on-write
+ingestion_worker = IngestionWorker(vector_memory, max_queue=settings.ingest_queue_size)
+
+# Packs retrieved docs + history into the prompt token budget
+prompt_assembler = PromptAssembler(
+    settings.prompt_token_budget,
+    context_share=settings.rag_context_share,
+)
 
 # Per-session short-term memory
 memory_store: Dict[str, ShortTermMemory] = {}
 
-def get_memory(session_id: str) -> ShortTermMemory:
+# Optional on-disk snapshots, restored lazily on first access
+snapshot_store = (
+    SessionSnapshotStore(
+        settings.session_snapshot_dir,
+        buckets=settings.session_snapshot_buckets,
+    )
+    if settings.session_snapshot_dir
+    else None
+)
+snapshotter = (
+    SessionSnapshotter(
+        snapshot_store,
+        sessions=lambda: memory_store,
+        interval=settings.session_snapshot_interval_seconds,
+    )
+    if snapshot_store
+    else None
+)
+
+async def get_memory(session_id: str) -> ShortTermMemory:
     if session_id not in memory_store:
-        memory_store[session_id] = ShortTermMemory()
-        logger.debug(f"Created memory for session={session_id}")
+        memory = ShortTermMemory()
+        # The store lock is shared with flushes (fsync, compaction) and a
+        # bucket's first load scans its whole file: keep both off the loop
+        restored = (
+            await asyncio.to_thread(snapshot_store.load, session_id)
+            if snapshot_store
+            else None
+        )
+        if session_id in memory_store:
+            # A concurrent request for the same session restored it first
+            return memory_store[session_id]
+        if restored:
+            memory.restore(restored)
+            logger.debug(f"Restored memory for session={session_id}")
+        else:
+            logger.debug(f"Created memory for session={session_id}")
+        memory_store[session_id] = memory
     return memory_store[session_id]
 
+# Resumable SSE streams (bounded replay buffers)
+stream_registry = StreamRegistry(
+    max_events=settings.stream_replay_max_events,
+    max_bytes=settings.stream_replay_max_bytes,
+    grace_seconds=settings.stream_resume_grace_seconds,
+)
+
+# On-demand sampling profiler (idle until an admin enables it)
+profiler = Profiler()
+
 # ---------------------------------------------------------------------
 # Schemas
 # ---------------------------------------------------------------------
 
+class RetrievalFilter(BaseModel):
+    sources: list[str] | None = None
+    path_prefix: str | None = None
+    tags: list[str] | None = None
+
+    def to_search_filter(self) -> SearchFilter:
+        return SearchFilter.create(
+            sources=self.sources,
+            path_prefix=self.path_prefix,
+            tags=self.tags,
+        )
+
 class ChatRequest(BaseModel):
     message: str = Field(..., min_length=1)
-    session_id: str | None = None
+    # Client-chosen ids become snapshot keys; generated ones are 36 chars
+    session_id: str | None = Field(None, max_length=128)
+    filter: RetrievalFilter | None = None
+
+class IngestItem(BaseModel):
+    text: str = Field(..., min_length=1)
+    source: str = "api"
+    tags: list[str] | None = None
+
+class IngestRequest(BaseModel):
+    documents: list[IngestItem] = Field(..., min_length=1)
+
+class ProfilingRequest(BaseModel):
+    sample_rate: float = Field(1.0, gt=0.0, le=1.0)
+    duration_seconds: float | None = Field(None, gt=0.0)
+    interval_ms: float = Field(5.0, ge=1.0, le=1000.0)
 
 class HealthResponse(BaseModel):
     status: str
     model: str
     version: str
 
+# ---------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------
+
+def require_api_key(x_api_key: str | None) -> None:
+    if not x_api_key or x_api_key != settings.internal_api_key:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+def require_admin_key(x_admin_key: str | None) -> None:
+    if not settings.admin_api_key:
+        raise HTTPException(status_code=403, detail="Admin API disabled")
+    if not x_admin_key or x_admin_key != settings.admin_api_key:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+def submit_ingest(documents: list[IngestDocument]) -> dict:
+    try:
+        job = ingestion_worker.submit(documents)
+    except IngestionError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    logger.info(f"Queued ingestion job={job.job_id}, documents={len(documents)}")
+    return job.to_dict()
+
+def sse_response(
+    stream: ResumableStream,
+    after_seq: int,
+    request: Request,
+    profile: RequestProfile | None = None,
+) -> StreamingResponse:
+    started = False
+
+    async def event_generator():
+        nonlocal started
+        started = True
+        try:
+            async with aclosing(stream.subscribe(after_seq)) as events:
+                async for event in until_disconnected(events, request):
+                    event_start = time.perf_counter() if profile else 0.0
+                    yield format_sse(stream.stream_id, event)
+                    if profile:
+                        profile.add("sse_write", time.perf_counter() - event_start)
+            if not stream.buffer.closed:
+                logger.info(f"Client disconnected: session={stream.session_id}")
+        except Exception as e:
+            logger.exception("Unexpected SSE error")
+            yield f"event: error\ndata: {str(e)}\n\n"
+        finally:
+            if profile:
+                profiler.finish_request(profile)
+
+    if profile:
+        def finish_unread_profile() -> None:
+            # The body is never iterated when the client leaves before
+            # streaming starts, so the generator's finally never runs
+            if not started:
+                profiler.finish_request(profile)
+
+        stream.add_done_callback(finish_unread_profile)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
 # ---------------------------------------------------------------------
 # Routes
 # ---------------------------------------------------------------------
@@ -112,77 +309,168 @@ async def health():
         version="1.0.0",
     )
 
+@app.get("/stats")
+async def stats(x_api_key: str = Header(None, alias="x-api-key")):
+    require_api_key(x_api_key)
+    return {
+        "streams": stream_registry.stats(),
+        "rag_cache": rag_cache.stats() if rag_cache else None,
+        "rag_batcher": rag_batcher.stats() if rag_batcher else None,
+        "session_snapshots": snapshotter.stats() if snapshotter else None,
+        "ingestion": ingestion_worker.stats(),
+        "prompt": prompt_assembler.stats(),
+    }
+
+@app.post("/ingest", status_code=202)
+async def ingest(req: IngestRequest, x_api_key: str = Header(None, alias="x-api-key")):
+    require_api_key(x_api_key)
+    return submit_ingest(
+        [IngestDocument(item.text, item.source, item.tags) for item in req.documents]
+    )
+
+@app.post("/ingest/upload", status_code=202)
+async def ingest_upload(
+    request: Request,
+    source: str = Query(..., min_length=1),
+    tags: list[str] | None = Query(None),
+    x_api_key: str = Header(None, alias="x-api-key"),
+):
+    require_api_key(x_api_key)
+    body = bytearray()
+    async for piece in request.stream():
+        body.extend(piece)
+        if len(body) > settings.ingest_max_upload_bytes:
+            raise HTTPException(status_code=413, detail="Upload too large")
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Upload must be UTF-8 text")
+    if not text.strip():
+        raise HTTPException(status_code=400, detail="Empty upload")
+    return submit_ingest([IngestDocument(text, source, tags)])
+
+@app.get("/ingest/{job_id}")
+async def ingest_status(job_id: str, x_api_key: str = Header(None, alias="x-api-key")):
+    require_api_key(x_api_key)
+    job = ingestion_worker.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown ingestion job")
+    return job.to_dict()
+
+@app.post("/admin/profiling/start")
+async def start_profiling(
+    req: ProfilingRequest,
+    x_admin_key: str = Header(None, alias="x-admin-key"),
+):
+    require_admin_key(x_admin_key)
+    profiler.enable(
+        sample_rate=req.sample_rate,
+        duration_seconds=req.duration_seconds,
+        interval_ms=req.interval_ms,
+    )
+    logger.info(
+        f"Profiling enabled: sample_rate={req.sample_rate}, "
+        f"duration={req.duration_seconds}s"
+    )
+    return profiler.stats()
+
+@app.post("/admin/profiling/stop")
+async def stop_profiling(x_admin_key: str = Header(None, alias="x-admin-key")):
+    require_admin_key(x_admin_key)
+    profiler.disable()
+    logger.info("Profiling disabled")
+    return profiler.stats()
+
+@app.get("/admin/profiling")
+async def profiling_status(x_admin_key: str = Header(None, alias="x-admin-key")):
+    require_admin_key(x_admin_key)
+    return profiler.stats()
+
+@app.get("/admin/profiling/profile")
+async def download_profile(
+    format: Literal["collapsed", "speedscope"] = "collapsed",
+    x_admin_key: str = Header(None, alias="x-admin-key"),
+):
+    require_admin_key(x_admin_key)
+    if format == "speedscope":
+        return profiler.speedscope()
+    return PlainTextResponse(profiler.collapsed())
+
 @app.post("/chat")
 async def chat(
     req: ChatRequest,
     request: Request,
     x_api_key: str = Header(None, alias="x-api-key"),
+    last_event_id: str | None = Header(None, alias="last-event-id"),
 ):
     # ------------------ Auth ------------------
-    if not x_api_key or x_api_key != settings.internal_api_key:
-        raise HTTPException(status_code=401, detail="Unauthorized")
+    require_api_key(x_api_key)
+
+    # ------------------ Resume ------------------
+    if last_event_id:
+        resumed = stream_registry.resume(last_event_id, session_id=req.session_id)
+        if resumed is not None:
+            stream, after_seq = resumed
+            logger.info(
+                f"Resuming stream={stream.stream_id} after event={after_seq}, "
+                f"session={stream.session_id}"
+            )
+            return sse_response(stream, after_seq, request)
+        logger.info(f"Cannot resume Last-Event-ID={last_event_id}, starting new stream")
 
     user_msg = req.message.strip()
     if not user_msg:
         raise HTTPException(status_code=400, detail="Empty message")
 
     session_id = req.session_id or str(uuid.uuid4())
-    memory = get_memory(session_id)
+    memory = await get_memory(session_id)
 
     logger.info(
         f"Chat request session={session_id}, message_length={len(user_msg)}"
     )
 
-    # ------------------ Store user message ------------------
-    memory.add("user", user_msg)
-
-    # ------------------ RAG Context ------------------
-    rag_context = rag_engine.build_context(user_msg)
-
-    # ------------------ Final messages ------------------
-    messages = (
-        rag_context
-        + memory.build()
-        + [{"role": "user", "content": user_msg}]
-    )
-
-    # ------------------ SSE Generator ------------------
-    async def event_generator():
-        assistant_text = ""
-
-        try:
-            yield "event: start\ndata: {}\n\n"
-
-            async for event in stream_agent(messages):
-                if await request.is_disconnected():
-                    logger.info(f"Client disconnected: session={session_id}")
-                    break
-
-                if event["type"] == "token":
-                    assistant_text += event["data"]
-                    yield f"event: token\ndata: {event['data']}\n\n"
-
-                elif event["type"] == "done":
-                    break
-
-            if assistant_text:
-                memory.add("assistant", assistant_text)
-                logger.info(
-                    f"Chat completed session={session_id}, "
-                    f"response_length={len(assistant_text)}"
-                )
-
-            yield "event: done\ndata: {}\n\n"
-
-        except Exception as e:
-            logger.exception("Unexpected SSE error")
-            yield f"event: error\ndata: {str(e)}\n\n"
-
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-        },
+    # None unless profiling is on and this request was sampled
+    profile = profiler.start_request("chat")
+
+    try:
+        # ------------------ Store user message ------------------
+        memory.add("user", user_msg)
+
+        # ------------------ RAG Context ------------------
+        filters = req.filter.to_search_filter() if req.filter else None
+        with span("retrieval"):
+            docs = await rag_engine.aretrieve(user_msg, filters=filters)
+
+        # ------------------ Final messages ------------------
+        with span("prompt_assembly"):
+            messages, prompt_stats = prompt_assembler.assemble(
+                user_msg, memory.build(), [doc_text(doc) for doc in docs]
+            )
+        logger.debug(f"Prompt assembled session={session_id}: {prompt_stats.to_dict()}")
+
+        # ------------------ Upstream generation ------------------
+        # Runs independently of this connection so a dropped client can resume
+        def store_answer(assistant_text: str) -> None:
+            memory.add("assistant", assistant_text)
+            logger.info(
+                f"Chat completed session={session_id}, "
+                f"response_length={len(assistant_text)}"
+            )
+
+        source = stream_agent(messages)
+        if profile:
+            source = profile.time_iter(source, "upstream_streaming")
+
+        stream = stream_registry.create(session_id)
+        stream.start(
+            source,
+            on_complete=store_answer,
+            max_tokens=settings.model_max_tokens,
         )
+
+        return sse_response(stream, 0, request, profile)
+    except BaseException:
+        # Not handed off to a response: nothing else will finish the profile
+        if profile:
+            profiler.finish_request(profile)
+        raise
@@ -0,0 +1,6 @@
+"""Shared test setup."""
+import os
+
+# Modules such as src.main and src.agent.deepseek load settings at import time
+os.environ.setdefault("OPENROUTER_API_KEY", "test_openrouter_key")
+os.environ.setdefault("INTERNAL_API_KEY", "test_internal_key")
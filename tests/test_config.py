@@ -68,3 +68,31 @@ def test_temperature_bounds(monkeypatch):
     monkeypatch.setenv("MODEL_TEMPERATURE", "3.0")
     with pytest.raises(ValidationError):
         Settings()
+
+
+def test_prompt_budget_must_fit_context_window(monkeypatch):
+    """Test that prompt budget plus completion tokens fit the context window."""
+    monkeypatch.setenv("OPENROUTER_API_KEY", "key1")
+    monkeypatch.setenv("INTERNAL_API_KEY", "key2")
+    monkeypatch.setenv("MODEL_CONTEXT_TOKENS", "8000")
+    monkeypatch.setenv("MODEL_MAX_TOKENS", "2000")
+    monkeypatch.setenv("PROMPT_TOKEN_BUDGET", "6000")
+    assert Settings().prompt_token_budget == 6000
+
+    monkeypatch.setenv("PROMPT_TOKEN_BUDGET", "6001")
+    with pytest.raises(ValidationError):
+        Settings()
+
+
+def test_empty_near_duplicate_bits_disables_collapsing(monkeypatch):
+    """Test that an empty RAG_NEAR_DUPLICATE_BITS turns dedup off."""
+    monkeypatch.setenv("OPENROUTER_API_KEY", "key1")
+    monkeypatch.setenv("INTERNAL_API_KEY", "key2")
+    assert Settings().rag_near_duplicate_bits == 10
+
+    monkeypatch.setenv("RAG_NEAR_DUPLICATE_BITS", "")
+    assert Settings().rag_near_duplicate_bits is None
+
+    monkeypatch.setenv("RAG_NEAR_DUPLICATE_BITS", "65")
+    with pytest.raises(ValidationError):
+        Settings()
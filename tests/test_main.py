@@ -0,0 +1,115 @@
+"""Endpoint tests for the FastAPI app (ingestion, admin profiling, lifespan)."""
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import main
+from src.core.memory.short_term import ShortTermMemory
+from src.core.memory.snapshot import SessionSnapshotStore, SessionSnapshotter
+from src.core.memory.vector_memory import VectorMemory
+from src.core.profiling import Profiler
+from src.core.rag.ingestion import IngestionWorker
+
+API_HEADERS = {"x-api-key": "test_internal_key"}
+ADMIN_HEADERS = {"x-admin-key": "test_admin_key"}
+
+
+@pytest.fixture
+def app_state(monkeypatch, tmp_path):
+    """
+    Fresh module-level singletons per test; an asyncio.Queue binds to the
+    loop of the first TestClient that uses it.
+    """
+    memory = VectorMemory()
+    sessions = {}
+    store = SessionSnapshotStore(str(tmp_path / "snapshots"), buckets=4)
+    monkeypatch.setattr(main.settings, "admin_api_key", "test_admin_key")
+    monkeypatch.setattr(main, "ingestion_worker", IngestionWorker(memory))
+    monkeypatch.setattr(main, "profiler", Profiler())
+    monkeypatch.setattr(main, "memory_store", sessions)
+    monkeypatch.setattr(main, "snapshot_store", store)
+    monkeypatch.setattr(
+        main, "snapshotter", SessionSnapshotter(store, sessions=lambda: sessions, interval=60)
+    )
+    return memory, sessions, store
+
+
+def wait_for_job(client, job_id, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = client.get(f"/ingest/{job_id}", headers=API_HEADERS).json()
+        if status["state"] in ("done", "failed") or time.monotonic() > deadline:
+            return status
+        time.sleep(0.01)
+
+
+def test_ingest_and_job_status(app_state):
+    """Ingested documents are indexed in the background and reported by job id."""
+    memory, _, _ = app_state
+    with TestClient(main.app) as client:
+        response = client.post(
+            "/ingest",
+            json={"documents": [
+                {"text": "kafka consumer groups\n\nkafka partitions", "source": "kafka.md"},
+            ]},
+            headers=API_HEADERS,
+        )
+        assert response.status_code == 202
+        job = response.json()
+        assert job["documents"] == 1
+
+        status = wait_for_job(client, job["job_id"])
+        assert status["state"] == "done" and status["chunks"] == 2
+        assert memory.search("kafka partitions")[0] == "kafka partitions"
+
+        assert client.get("/ingest/unknown", headers=API_HEADERS).status_code == 404
+        assert client.post("/ingest", json={"documents": []}, headers=API_HEADERS).status_code == 422
+        assert client.get(f"/ingest/{job['job_id']}").status_code == 401
+
+
+def test_admin_profiling_endpoints(app_state):
+    """Profiling is switched on and off by an admin and exports its samples."""
+    with TestClient(main.app) as client:
+        assert client.get("/admin/profiling").status_code == 401
+
+        response = client.post(
+            "/admin/profiling/start",
+            json={"sample_rate": 0.5, "interval_ms": 2},
+            headers=ADMIN_HEADERS,
+        )
+        assert response.status_code == 200 and response.json()["enabled"]
+        assert client.get("/admin/profiling", headers=ADMIN_HEADERS).json()["enabled"]
+
+        collapsed = client.get("/admin/profiling/profile", headers=ADMIN_HEADERS)
+        assert collapsed.headers["content-type"].startswith("text/plain")
+        speedscope = client.get(
+            "/admin/profiling/profile", params={"format": "speedscope"}, headers=ADMIN_HEADERS
+        ).json()
+        assert speedscope["shared"] == {"frames": []} and speedscope["profiles"] == []
+
+        response = client.post("/admin/profiling/stop", headers=ADMIN_HEADERS)
+        assert not response.json()["enabled"]
+        assert main.profiler._sampler is None
+
+
+def test_admin_profiling_disabled_without_key(app_state, monkeypatch):
+    """The admin API is off when no admin key is configured."""
+    monkeypatch.setattr(main.settings, "admin_api_key", None)
+    with TestClient(main.app) as client:
+        assert client.get("/admin/profiling", headers=ADMIN_HEADERS).status_code == 403
+
+
+def test_lifespan_flushes_snapshots_and_stops_background_work(app_state):
+    """Shutdown writes dirty sessions and stops the profiler."""
+    _, sessions, store = app_state
+    with TestClient(main.app) as client:
+        memory = ShortTermMemory()
+        memory.add("user", "remember me")
+        sessions["s1"] = memory
+        client.post("/admin/profiling/start", json={}, headers=ADMIN_HEADERS)
+        assert main.profiler.enabled
+
+    assert store.load("s1") == [{"role": "user", "content": "remember me"}]
+    assert main.snapshotter.stats()["snapshots_written"] == 1
+    assert not main.profiler.enabled
@@ -1,6 +1,11 @@
 """Unit tests for memory management."""
+import asyncio
+import time
+
 import pytest
+from src.core.memory.prompt_assembler import PromptAssembler
 from src.core.memory.short_term import ShortTermMemory
+from src.core.memory.snapshot import SessionSnapshotStore, SessionSnapshotter
 
 
 def test_memory_initialization():
@@ -63,3 +68,164 @@ def test_empty_memory_build():
     
     assert messages == []
     assert isinstance(messages, list)
+
+
+def test_memory_version_tracks_changes():
+    """Test that adds bump the version but restores do not."""
+    memory = ShortTermMemory(max_messages=2)
+    memory.restore([{"role": "user", "content": str(i)} for i in range(3)])
+    assert memory.version == 0
+    assert [m["content"] for m in memory.messages] == ["1", "2"]
+
+    memory.add("assistant", "hi")
+    assert memory.version == 1
+
+
+def test_snapshot_roundtrip_in_new_process(tmp_path):
+    """Test that a fresh store lazily reads the latest snapshot."""
+    store = SessionSnapshotStore(str(tmp_path), buckets=4)
+    store.write("s1", [{"role": "user", "content": "first"}])
+    store.write("s1", [
+        {"role": "user", "content": "first"},
+        {"role": "assistant", "content": "héllo ✨"},
+        {"role": "tool", "content": "custom role"},
+    ])
+
+    restarted = SessionSnapshotStore(str(tmp_path), buckets=4)
+    messages = restarted.load("s1")
+
+    assert [m["content"] for m in messages] == ["first", "héllo ✨", "custom role"]
+    assert messages[2]["role"] == "tool"
+    assert restarted.load("unknown") is None
+
+
+def test_snapshot_compaction_keeps_latest(tmp_path):
+    """Test that compaction drops superseded records."""
+    store = SessionSnapshotStore(str(tmp_path), buckets=1, min_compact_bytes=0)
+    for i in range(20):
+        store.write("s1", [{"role": "user", "content": f"message {i}" * 10}])
+
+    assert store.compactions > 0
+    restarted = SessionSnapshotStore(str(tmp_path), buckets=1)
+    assert restarted.load("s1")[0]["content"] == "message 19" * 10
+
+
+def test_snapshot_ignores_torn_tail(tmp_path):
+    """Test that a partially written record is discarded on restore."""
+    store = SessionSnapshotStore(str(tmp_path), buckets=1)
+    store.write("s1", [{"role": "user", "content": "kept"}])
+    with open(store._path(0), "ab") as f:
+        f.write(b"\x40\x00\x00\x00garbage")
+
+    restarted = SessionSnapshotStore(str(tmp_path), buckets=1)
+    assert restarted.load("s1") == [{"role": "user", "content": "kept"}]
+
+
+@pytest.mark.asyncio
+async def test_snapshotter_writes_only_dirty_sessions(tmp_path):
+    """Test that flushes are incremental."""
+    sessions = {"a": ShortTermMemory(), "b": ShortTermMemory()}
+    snapshotter = SessionSnapshotter(
+        SessionSnapshotStore(str(tmp_path), buckets=2),
+        sessions=lambda: sessions,
+    )
+    sessions["a"].add("user", "hello")
+
+    assert await snapshotter.flush() == 1
+    assert await snapshotter.flush() == 0
+
+    sessions["b"].add("user", "hey")
+    assert await snapshotter.flush() == 1
+
+
+@pytest.mark.asyncio
+async def test_snapshotter_shutdown_does_not_rewrite_inflight_flush(tmp_path):
+    """Test that shutdown waits for an in-flight flush and dead sessions are dropped."""
+    store = SessionSnapshotStore(str(tmp_path), buckets=1)
+    writes = []
+    write_many = store.write_many
+
+    def slow_write_many(sessions):
+        writes.append([sid for sid, _ in sessions])
+        time.sleep(0.1)
+        return write_many(sessions)
+
+    store.write_many = slow_write_many
+    sessions = {"a": ShortTermMemory()}
+    sessions["a"].add("user", "hello")
+    snapshotter = SessionSnapshotter(store, sessions=lambda: sessions, interval=0)
+
+    task = asyncio.create_task(snapshotter.run())
+    while not writes:
+        await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert await snapshotter.flush() == 0
+    assert writes == [["a"]]
+
+    del sessions["a"]
+    await snapshotter.flush()
+    assert snapshotter._written_versions == {}
+
+
+@pytest.mark.asyncio
+async def test_snapshotter_skips_unencodable_sessions(tmp_path):
+    """Test that one oversized session does not block the others."""
+    store = SessionSnapshotStore(str(tmp_path), buckets=1)
+    sessions = {"ok": ShortTermMemory(), "x" * 70_000: ShortTermMemory()}
+    for memory in sessions.values():
+        memory.add("user", "hello")
+    snapshotter = SessionSnapshotter(store, sessions=lambda: sessions)
+
+    assert await snapshotter.flush() == 1
+    assert snapshotter.stats()["snapshots_skipped"] == 1
+    assert await snapshotter.flush() == 0
+
+    sessions["ok"].add("assistant", "hi")
+    assert await snapshotter.flush() == 1
+    assert [m["content"] for m in store.load("ok")] == ["hello", "hi"]
+
+
+def test_prompt_assembler_dedupes_and_merges_context():
+    """Test that the current turn is sent once and docs share one system block."""
+    memory = ShortTermMemory()
+    memory.add("user", "Hi")
+    memory.add("assistant", "Hello")
+    memory.add("user", "How do I use FastAPI?")
+
+    messages, stats = PromptAssembler(budget=1000).assemble(
+        "How do I use FastAPI?",
+        memory.build(),
+        ["FastAPI is a web framework.", "FastAPI  is a web framework.", "Uvicorn serves it."],
+    )
+
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert messages[0]["content"].count("FastAPI is a web framework.") == 1
+    assert "Uvicorn serves it." in messages[0]["content"]
+    assert sum(m["content"] == "How do I use FastAPI?" for m in messages) == 1
+    assert stats.duplicates_removed == 2
+    assert stats.docs_used == 2 and stats.history_used == 2
+
+
+def test_prompt_assembler_packs_by_priority_within_budget():
+    """Test that docs and newest history are packed and overflow is reported."""
+    history = []
+    for i in range(6):
+        history.append({"role": "user", "content": f"question {i} " + "x" * 80})
+        history.append({"role": "assistant", "content": f"answer {i} " + "y" * 80})
+    docs = ["d" * 400, "best doc " * 10, "e" * 40]
+    assembler = PromptAssembler(budget=150, context_share=0.5)
+
+    messages, stats = assembler.assemble("latest?", history, docs)
+
+    assert stats.total_tokens <= 150
+    # Oversized top doc is skipped, smaller ones still fit
+    assert stats.docs_used == 2 and stats.docs_dropped == 1
+    assert "d" * 400 not in messages[0]["content"]
+    # History kept is the contiguous most recent suffix
+    kept = messages[1:-1]
+    assert kept == history[len(history) - len(kept):]
+    assert stats.history_dropped == len(history) - len(kept) > 0
+    assert set(stats.tokens) == {"context", "history", "user"}
+    assert assembler.stats()["tokens_dropped"] > 0
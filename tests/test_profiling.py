@@ -0,0 +1,126 @@
+"""Unit tests for the on-demand sampling profiler."""
+import asyncio
+import time
+
+from src.core import profiling
+from src.core.profiling import Profiler, span
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_disabled_profiler_is_a_noop():
+    """Nothing is sampled or timed until an admin turns profiling on."""
+    profiler = Profiler()
+    assert profiler.start_request("chat") is None
+    assert span("retrieval") is profiling._NOOP
+    assert profiler.stats()["sampled_requests"] == 0
+
+
+def test_sampled_request_collects_spans_and_stacks():
+    """Spans aggregate per request and the sampler captures loop stacks."""
+    profiler = Profiler()
+    profiler.enable(sample_rate=1.0, interval_ms=1.0)
+    try:
+        profile = profiler.start_request("chat")
+        assert profile is not None
+        with span("retrieval"):
+            busy(0.05)
+        profiler.finish_request(profile)
+    finally:
+        profiler.disable()
+
+    stats = profiler.stats()
+    assert not stats["enabled"]
+    assert stats["sampled_requests"] == 1
+    assert stats["spans"]["retrieval"]["total_ms"] >= 50
+    assert "total" in stats["spans"]
+    assert stats["stack_samples"] > 0
+
+    collapsed = profiler.collapsed()
+    assert "busy (test_profiling.py" in collapsed
+    stack, count = collapsed.splitlines()[0].rsplit(" ", 1)
+    assert int(count) > 0
+
+    doc = profiler.speedscope()
+    profile_doc = doc["profiles"][0]
+    assert len(profile_doc["samples"]) == len(profile_doc["weights"])
+    frames = doc["shared"]["frames"]
+    assert all(0 <= i < len(frames) for sample in profile_doc["samples"] for i in sample)
+
+
+def test_sampler_captures_worker_threads():
+    """Work offloaded with to_thread is sampled and tagged with its thread."""
+    async def main():
+        profile = profiler.start_request("chat")
+        await asyncio.to_thread(busy, 0.05)
+        profiler.finish_request(profile)
+
+    profiler = Profiler()
+    profiler.enable(sample_rate=1.0, interval_ms=1.0)
+    try:
+        asyncio.run(main())
+    finally:
+        profiler.disable()
+
+    worker_stacks = [
+        stack for stack in profiler.stacks
+        if "busy (test_profiling.py" in stack and not stack.startswith("thread:MainThread;")
+    ]
+    assert worker_stacks
+    assert all(stack.startswith("thread:asyncio_") for stack in worker_stacks)
+    assert not any(stack.startswith("thread:stack-sampler;") for stack in profiler.stacks)
+    names = {p["name"] for p in profiler.speedscope()["profiles"]}
+    assert "thread:MainThread" in names
+
+
+def test_finish_request_is_idempotent():
+    """A profile finished from two paths is only counted once."""
+    profiler = Profiler()
+    profiler.enable(sample_rate=1.0)
+    try:
+        profile = profiler.start_request("chat")
+        profiler.finish_request(profile)
+        profiler.finish_request(profile)
+        assert profiler._active_requests == 0
+        assert profiler.stats()["spans"]["total"]["count"] == 1
+    finally:
+        profiler.disable()
+
+
+def test_sample_rate_and_time_window():
+    """Only a fraction of requests is sampled, and only inside the window."""
+    profiler = Profiler()
+    profiler.enable(sample_rate=0.25, duration_seconds=0.2)
+    try:
+        sampled = [profiler.start_request("chat") for _ in range(2000)]
+        hits = [p for p in sampled if p is not None]
+        assert 350 < len(hits) < 650
+        for profile in hits:
+            profiler.finish_request(profile)
+
+        time.sleep(0.3)
+        assert not profiler.enabled
+        assert profiler.start_request("chat") is None
+    finally:
+        profiler.disable()
+
+
+def test_time_iter_charges_upstream_wait():
+    """Waiting on the upstream source is attributed to its span."""
+    async def source():
+        for i in range(3):
+            await asyncio.sleep(0.02)
+            yield i
+
+    async def main():
+        profile = profiling.RequestProfile("chat")
+        items = [item async for item in profile.time_iter(source(), "upstream_streaming")]
+        return items, profile
+
+    items, profile = asyncio.run(main())
+    assert items == [0, 1, 2]
+    assert profile.spans["upstream_streaming"] >= 0.05
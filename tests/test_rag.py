@@ -1,8 +1,21 @@
+import asyncio
+import json
 import os
+import random
+import threading
 import tempfile
 import shutil
+import numpy as np
 import pytest
 
+from src.core.exceptions import ConfigurationError
+from src.core.memory.vector_memory import VectorMemory
+from src.core.rag.batching import QueryBatcher
+from src.core.rag.benchmark import SyntheticCorpus, quality, run_benchmark
+from src.core.rag.cache import QueryEmbeddingCache, RetrievalCache
+from src.core.rag.dedup import mmr_select, pairwise_hamming, simhash_many
+from src.core.rag.filters import MetadataIndex, SearchFilter
+from src.core.rag.ingestion import IngestDocument, IngestionWorker
 from src.core.rag.vector_store import VectorStore
 from src.core.rag.rag_engine import RAGEngine
 
@@ -101,3 +114,655 @@ def test_rag_is_deterministic(rag_engine):
     c2 = rag_engine.build_context("What is Python?")
 
     assert c1 == c2
+
+
+@pytest.fixture(scope="module")
+def synthetic_corpus():
+    """
+    Random bag-of-words documents plus queries sampled from them.
+    """
+    rng = random.Random(0)
+    vocab = [f"term{i}" for i in range(2000)]
+    docs = [" ".join(rng.sample(vocab, 30)) for _ in range(1000)]
+    queries = [" ".join(rng.sample(doc.split(), 5)) for doc in rng.sample(docs, 50)]
+    return docs, queries
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_compact_storage_recall_and_memory(synthetic_corpus, dtype):
+    """
+    Compact dtypes shrink vectors while re-ranking keeps recall near exact.
+    """
+    docs, queries = synthetic_corpus
+    store = VectorStore(embedding_model="test", dtype=dtype, rerank_factor=4)
+    store.add_texts(docs)
+
+    report = store.quantization_report(queries, k=5)
+
+    assert report["bytes_per_vector"] < report["float32_bytes_per_vector"]
+    assert report["recall@5"] >= 0.95
+
+
+def test_quantized_store_persists(tmp_path, temp_docs_dir):
+    """
+    int8 codes and scales round-trip through the persisted store.
+    """
+    path = str(tmp_path / "store")
+    store = VectorStore(persist_path=path, embedding_model="test", dtype="int8")
+    store.ingest_directory(temp_docs_dir)
+
+    reloaded = VectorStore(persist_path=path, embedding_model="test", dtype="int8")
+
+    assert reloaded.count() == store.count()
+    assert reloaded.search("Explain FAISS", top_k=1) == store.search("Explain FAISS", top_k=1)
+
+
+def test_rerank_reads_stored_originals(synthetic_corpus, tmp_path, monkeypatch):
+    """
+    Exact re-ranking reads the float32 originals (memory-mapped once saved)
+    instead of re-embedding candidate chunks.
+    """
+    docs, queries = synthetic_corpus
+    path = str(tmp_path / "store")
+    store = VectorStore(persist_path=path, embedding_model="test", dtype="int8")
+    store.add_texts(docs)
+    store.save()
+    reloaded = VectorStore(persist_path=path, embedding_model="test", dtype="int8")
+    assert isinstance(reloaded._originals._saved, np.memmap)
+
+    embedded = []
+    embed = reloaded.embedder.embed
+    monkeypatch.setattr(
+        reloaded.embedder, "embed", lambda texts: embedded.extend(texts) or embed(texts)
+    )
+    assert reloaded.search(queries[0], top_k=5) == store.search(queries[0], top_k=5)
+    # Only the query itself is embedded
+    assert len(embedded) == 1
+
+
+@pytest.mark.parametrize("saved, requested", [("float32", "int8"), ("int8", "float32")])
+def test_load_converts_to_requested_dtype(synthetic_corpus, tmp_path, saved, requested):
+    """
+    Reopening a store with another dtype converts it instead of silently
+    keeping the stored one.
+    """
+    docs, queries = synthetic_corpus
+    path = str(tmp_path / "store")
+    store = VectorStore(persist_path=path, embedding_model="test", dtype=saved)
+    store.add_texts(docs)
+    store.save()
+
+    reopened = VectorStore(persist_path=path, embedding_model="test", dtype=requested)
+
+    assert reopened.index.dtype == requested
+    assert reopened.quantization_report(queries, k=5)["recall@5"] >= 0.95
+    best = store.search(queries[0], top_k=1)[0]["text"]
+    assert reopened.search(queries[0], top_k=1)[0]["text"] == best
+
+
+@pytest.fixture(scope="module")
+def clustered_corpus():
+    """
+    Documents drawn from a fixed set of topics, so vectors form clusters.
+    """
+    rng = random.Random(1)
+    vocab = [f"word{i}" for i in range(5000)]
+    topics = [rng.sample(vocab, 40) for _ in range(40)]
+    docs = [" ".join(rng.sample(rng.choice(topics), 15)) for _ in range(4000)]
+    queries = [" ".join(rng.sample(rng.choice(topics), 5)) for _ in range(50)]
+    return docs, queries
+
+
+def test_ivf_recall_and_nprobe(clustered_corpus):
+    """
+    IVF approaches exact recall as nprobe grows.
+    """
+    docs, queries = clustered_corpus
+    store = VectorStore(embedding_model="test", index="ivf", nlist=32, nprobe=1)
+    store.add_texts(docs)
+    store.train()
+
+    low = store.quantization_report(queries, k=5)["recall@5"]
+    store.index.nprobe = 32
+    full = store.quantization_report(queries, k=5)["recall@5"]
+
+    assert full == pytest.approx(1.0)
+    assert low <= full
+    assert store.index.list_sizes().sum() == len(docs)
+
+
+def test_ivf_train_decodes_only_sample_and_blocks(clustered_corpus, monkeypatch):
+    """
+    Training never decodes the whole quantized corpus at once.
+    """
+    from src.core.rag import index as index_module
+
+    docs, _ = clustered_corpus
+    store = VectorStore(embedding_model="test", index="ivf", dtype="int8", nlist=16)
+    store.add_texts(docs)
+    store.index.max_train_points = 500
+    monkeypatch.setattr(index_module, "ASSIGN_BLOCK_ROWS", 1000)
+    decoded = []
+    decode = store.index.vectors.decode
+    monkeypatch.setattr(
+        store.index.vectors, "decode", lambda rows=None: decoded.append(rows) or decode(rows)
+    )
+    store.train()
+
+    assert all(rows is not None and len(rows) <= 1000 for rows in decoded)
+    assert store.index.list_sizes().sum() == len(docs)
+    assert store.index.bytes_per_vector == store.index.vectors.bytes_per_vector + 16
+
+
+def test_ivf_incremental_add_without_retrain(clustered_corpus):
+    """
+    Documents added after training are searchable via their nearest list.
+    """
+    docs, _ = clustered_corpus
+    store = VectorStore(embedding_model="test", index="ivf", nlist=16)
+    store.add_texts(docs[:1000])
+    store.train()
+    centroids = store.index.centroids.copy()
+    lists_before = [ids.copy() for ids in store.index._lists]
+    held = list(store.index._lists)
+
+    store.add("zebra giraffe okapi savanna", source="late.txt")
+    results = store.search("okapi savanna", top_k=1, nprobe=16)
+
+    assert np.array_equal(store.index.centroids, centroids)
+    assert results[0]["source"] == "late.txt"
+    # Readers holding the old lists never see them change
+    assert all(np.array_equal(a, b) for a, b in zip(held, lists_before))
+    with pytest.raises(ValueError):
+        store.search("okapi savanna", top_k=1, nprobe=0)
+
+
+def test_ivf_trains_on_ingest_and_persists(tmp_path, temp_docs_dir):
+    """
+    Ingestion trains the IVF quantizer and the trained lists are persisted.
+    """
+    path = str(tmp_path / "ivf")
+    store = VectorStore(persist_path=path, embedding_model="test", index="ivf")
+    store.ingest_directory(temp_docs_dir)
+    assert store.index.trained
+
+    reloaded = VectorStore(persist_path=path, embedding_model="test", index="ivf")
+    assert reloaded.index.trained
+    assert reloaded.search("Explain FAISS", top_k=1) == store.search("Explain FAISS", top_k=1)
+
+
+@pytest.fixture(scope="module")
+def tagged_store():
+    """
+    Store with chunks from several projects and tags.
+    """
+    store = VectorStore(embedding_model="test")
+    store.add("Deploy the api service with docker", source="api/deploy.md", tags=["ops"])
+    store.add("The api exposes a chat endpoint", source="api/readme.md")
+    store.add("Deploy the web frontend with docker", source="web/deploy.md", tags=["ops"])
+    store.add("Docker images are built nightly", source="infra/ci.md", tags=["ops", "ci"])
+    return store
+
+
+def test_filter_by_source_prefix_and_tags(tagged_store):
+    """
+    Filters restrict results to matching chunks before scoring.
+    """
+    by_prefix = tagged_store.search(
+        "deploy docker", filters=SearchFilter.create(path_prefix="api/")
+    )
+    by_source = tagged_store.search(
+        "docker", filters=SearchFilter.create(sources=["web/deploy.md"])
+    )
+    by_tags = tagged_store.search(
+        "docker", filters=SearchFilter.create(tags=["ops", "ci"])
+    )
+
+    assert {r["source"] for r in by_prefix} == {"api/deploy.md"}
+    assert [r["source"] for r in by_source] == ["web/deploy.md"]
+    assert [r["source"] for r in by_tags] == ["infra/ci.md"]
+    assert tagged_store.search("docker", filters=SearchFilter.create(sources=["missing.md"])) == []
+
+
+def test_filter_bitsets_combine_and_grow():
+    """
+    Cached per-value bitsets are ORed within a condition and ANDed across them.
+    """
+    index = MetadataIndex()
+    for row in range(20):
+        index.add(f"dir{row % 2}/file{row % 5}.md", tags=["even"] if row % 2 == 0 else None)
+
+    mask = index.mask(SearchFilter.create(path_prefix="dir0/", tags=["even"]))
+    assert np.flatnonzero(mask).tolist() == list(range(0, 20, 2))
+    mask = index.mask(SearchFilter.create(sources=["dir1/file1.md", "dir0/file2.md"]))
+    assert np.flatnonzero(mask).tolist() == [1, 2, 11, 12]
+
+    index.add("dir1/file1.md")
+    assert index.mask(SearchFilter.create(sources=["dir1/file1.md"]))[20]
+
+
+def test_backend_search_rejects_filters():
+    """
+    Filters are never silently dropped when an external backend searches.
+    """
+    class Backend:
+        def search(self, query, top_k):
+            return []
+
+    store = VectorStore(backend=Backend())
+    assert store.search("x") == []
+    with pytest.raises(ConfigurationError):
+        store.search("x", filters=SearchFilter.create(tags=["ops"]))
+
+
+def test_rag_engine_passes_filter_to_vector_memory():
+    """
+    build_context forwards filters to the keyword VectorMemory store.
+    """
+    memory = VectorMemory()
+    memory.add("Redis stores session memory", source="backend/memory.md")
+    memory.add("Redis is also used by the frontend cache", source="frontend/cache.md")
+    engine = RAGEngine(memory)
+
+    context = engine.build_context("redis", filters=SearchFilter.create(path_prefix="frontend/"))
+
+    assert len(context) == 1
+    assert "frontend cache" in context[0]["content"]
+
+
+def test_retrieval_cache_hits_and_generation_invalidation():
+    """
+    Repeated queries hit the cache until the store changes.
+    """
+    memory = VectorMemory()
+    memory.add("Python is a programming language", source="a.txt")
+    cache = RetrievalCache(max_entries=8)
+    engine = RAGEngine(memory, cache=cache)
+
+    first = engine.build_context("What is Python?")
+    second = engine.build_context("  what IS python? ")
+    assert first == second
+    assert cache.stats()["hits"] == 1
+
+    memory.add("Python is popular for scripting", source="b.txt")
+    third = engine.build_context("What is Python?")
+
+    assert len(third) == 2
+    stats = cache.stats()
+    assert stats["stale"] == 1
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
+
+
+def test_retrieval_cache_is_bounded():
+    """
+    The least recently used entry is evicted once the cache is full.
+    """
+    cache = RetrievalCache(max_entries=2)
+    cache.put("a", 0, ["doc-a"])
+    cache.put("b", 0, ["doc-b"])
+    cache.get("a", 0)
+    cache.put("c", 0, ["doc-c"])
+
+    assert cache.get("b", 0) is None
+    assert cache.get("a", 0) == ["doc-a"]
+    assert cache.stats()["entries"] == 2
+
+
+def test_vector_store_caches_query_embeddings(vector_store):
+    """
+    Query embeddings are reused for normalized-equal queries.
+    """
+    first = vector_store.embed_query("What is FastAPI?")
+    second = vector_store.embed_query("what is   fastapi?")
+
+    assert first is second
+
+
+def test_query_embedding_cache_embeds_original_text():
+    """
+    The normalized query is only the cache key; the embedder sees the query as given.
+    """
+    class RecordingEmbedder:
+        dim = 2
+
+        def __init__(self):
+            self.seen = []
+
+        def embed(self, texts):
+            self.seen.extend(texts)
+            return np.ones((len(texts), 2), dtype=np.float32)
+
+    embedder = RecordingEmbedder()
+    cache = QueryEmbeddingCache(embedder, max_entries=8)
+    cache.embed(["What is FastAPI?", "what is   fastapi?", "Other"])
+    cache.embed(["WHAT IS FASTAPI?"])
+
+    assert embedder.seen == ["What is FastAPI?", "Other"]
+
+
+def test_cached_hits_are_copied_per_caller(vector_store):
+    """
+    Editing returned hits never changes what the cache hands out next.
+    """
+    engine = RAGEngine(vector_store, top_k=2, cache=RetrievalCache(max_entries=8))
+    first = engine.retrieve("What is FastAPI?")
+    first[0]["text"] = "edited"
+    first[0]["score"] = -1.0
+
+    second = engine.retrieve("What is FastAPI?")
+    assert second[0]["text"] != "edited"
+    assert second[0]["score"] > 0
+
+
+def test_rag_engine_caches_mmr_query_embeddings():
+    """
+    Over a keyword store the engine keeps its own query-embedding cache for MMR.
+    """
+    memory = VectorMemory(near_duplicate_distance=None)
+    for text in ["redis cache eviction", "redis cluster setup", "redis persistence"]:
+        memory.add(text)
+    engine = RAGEngine(memory, top_k=2, mmr_lambda=0.5)
+    calls = []
+    embed = engine.embedder.embed
+    engine.embedder.embed = lambda texts: calls.append(list(texts)) or embed(texts)
+
+    engine.retrieve("Redis")
+    engine.retrieve("redis")
+
+    query_calls = [texts for texts in calls if texts == ["Redis"] or texts == ["redis"]]
+    assert query_calls == [["Redis"]]
+
+
+def test_search_batch_matches_single_queries(vector_store):
+    """
+    Batched search returns exactly what per-query search returns.
+    """
+    queries = ["What is FastAPI?", "", "vector similarity search", "what is   fastapi?"]
+    batched = vector_store.search_batch(queries, top_k=2)
+
+    assert batched == [vector_store.search(query, top_k=2) for query in queries]
+    assert batched[1] == []
+
+
+class CountingStore:
+    def __init__(self, store):
+        self.store = store
+        self.calls = []
+        self.generation = 0
+
+    def search_batch(self, queries, top_k, filters=None):
+        self.calls.append(list(queries))
+        return self.store.search_batch(queries, top_k, filters=filters)
+
+
+@pytest.mark.asyncio
+async def test_query_batcher_groups_concurrent_queries(vector_store):
+    """
+    Concurrent queries are searched together, split by batch size and filters.
+    """
+    store = CountingStore(vector_store)
+    batcher = QueryBatcher(store, max_wait=0.01, max_batch_size=4)
+    queries = [f"python question {i}" for i in range(6)]
+    only_doc1 = SearchFilter.create(sources=["doc1.txt"])
+
+    results = await asyncio.gather(
+        *(batcher.search(query, 2) for query in queries),
+        batcher.search("fastapi", 2, only_doc1),
+    )
+
+    assert sorted(len(call) for call in store.calls) == [1, 2, 4]
+    assert results[:6] == [vector_store.search(query, 2) for query in queries]
+    assert {hit["source"] for hit in results[6]} <= {"doc1.txt"}
+    assert batcher.stats()["queries"] == 7
+
+
+@pytest.mark.asyncio
+async def test_rag_engine_async_path_uses_batcher_and_cache(vector_store):
+    """
+    The async context builder matches the sync one and still hits the cache.
+    """
+    store = CountingStore(vector_store)
+    engine = RAGEngine(
+        store,
+        top_k=2,
+        cache=RetrievalCache(16),
+        batcher=QueryBatcher(store, max_wait=0.005),
+    )
+    expected = RAGEngine(vector_store, top_k=2).build_context("What is FastAPI?")
+
+    first, second = await asyncio.gather(
+        engine.abuild_context("What is FastAPI?"),
+        engine.abuild_context("vector search"),
+    )
+    again = await engine.abuild_context("what is fastapi?")
+
+    assert first == expected == again
+    assert second
+    assert store.calls == [["What is FastAPI?", "vector search"]]
+    assert engine.cache.hits == 1
+
+
+def test_vector_memory_publishes_whole_batches():
+    """
+    Readers see each add_documents batch entirely or not at all.
+    """
+    # Templated texts are near-duplicates; count every row here
+    memory = VectorMemory(near_duplicate_distance=None)
+    batch_size = 50
+    stop = threading.Event()
+    torn = []
+
+    def writer():
+        for batch in range(40):
+            memory.add_documents(
+                (f"shared batch{batch} item{i}", "doc", None) for i in range(batch_size)
+            )
+        stop.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while not stop.is_set():
+        hits = memory.search("shared", k=10_000)
+        if len(hits) % batch_size:
+            torn.append(len(hits))
+    thread.join()
+
+    assert not torn
+    assert len(memory) == 40 * batch_size
+    assert memory.generation == 40
+    # Size-tiered merging keeps the segment count logarithmic
+    assert len(memory._snapshot.segments) <= 6
+
+
+@pytest.mark.asyncio
+async def test_ingestion_worker_indexes_in_background():
+    """
+    Queued documents are chunked, become searchable, and are reported.
+    """
+    memory = VectorMemory()
+    worker = IngestionWorker(memory, max_queue=2)
+    task = asyncio.create_task(worker.run())
+    try:
+        job = worker.submit([
+            IngestDocument("kafka consumer groups\n\nkafka partitions", "kafka.md", ["infra"]),
+        ])
+        assert job.state == "queued"
+        await worker.drain()
+
+        assert job.state == "done" and job.chunks == 2
+        # The text is released; the status keeps the count
+        assert job.documents is None and job.to_dict()["documents"] == 1
+        assert memory.search("kafka partitions") == ["kafka partitions", "kafka consumer groups"]
+        filtered = memory.search("kafka", filters=SearchFilter.create(tags=["infra"]))
+        assert len(filtered) == 2
+
+        stats = worker.stats()
+        assert stats["chunks_indexed"] == 2
+        assert stats["last_lag_ms"] is not None and stats["chunks_per_second"] > 0
+    finally:
+        task.cancel()
+
+
+def test_ingestion_worker_requires_copy_on_write_store():
+    """
+    A store that writes in place is refused as a background indexing target.
+    """
+    with pytest.raises(ConfigurationError):
+        IngestionWorker(VectorStore())
+
+
+NEAR_DUPLICATE_DOCS = [
+    "Run the server with uvicorn main:app --reload and open the docs page in a browser to try the endpoints.",
+    "Run the server with uvicorn main:app --reload, then open the docs page in your browser to try the endpoints.",
+    "Run the server using uvicorn main:app --reload and open the docs page in a browser to try endpoints.",
+    "Deploy the server behind nginx and run uvicorn workers under a process manager such as systemd.",
+]
+
+
+def test_simhash_separates_near_and_unrelated_chunks():
+    """
+    Lightly edited paragraphs have close fingerprints, unrelated ones do not.
+    """
+    distances = pairwise_hamming(simhash_many(NEAR_DUPLICATE_DOCS))
+
+    assert distances[0, 1] <= 10 and distances[0, 2] <= 10
+    assert distances[0, 3] > 10
+    assert (np.diag(distances) == 0).all()
+
+
+@pytest.mark.parametrize("store_factory", [VectorStore, VectorMemory])
+def test_search_collapses_near_duplicates(store_factory):
+    """
+    Both stores return one copy of a repeated paragraph plus distinct results.
+    """
+    store = store_factory()
+    for text in NEAR_DUPLICATE_DOCS:
+        store.add(text, source="guide.md")
+
+    results = store.search("run uvicorn server docs", 3)
+    texts = [r if isinstance(r, str) else r["text"] for r in results]
+
+    assert len(texts) == 2
+    assert texts[1] == NEAR_DUPLICATE_DOCS[3]
+
+    undeduped = store_factory(near_duplicate_distance=None)
+    for text in NEAR_DUPLICATE_DOCS:
+        undeduped.add(text, source="guide.md")
+    assert len(undeduped.search("run uvicorn server docs", 3)) == 3
+
+
+def test_vector_store_persists_fingerprints(tmp_path):
+    """
+    Fingerprints computed at ingest, one add at a time, survive a save/load
+    round trip.
+    """
+    store = VectorStore(persist_path=str(tmp_path))
+    for text in NEAR_DUPLICATE_DOCS:
+        store.add(text)
+    assert len(store._fingerprints) >= len(NEAR_DUPLICATE_DOCS)
+    store.save()
+
+    reloaded = VectorStore(persist_path=str(tmp_path))
+    assert np.array_equal(reloaded._fingerprints, simhash_many(NEAR_DUPLICATE_DOCS))
+
+
+def test_mmr_prefers_novel_candidates():
+    """
+    MMR skips a candidate that repeats an already selected one.
+    """
+    query = np.array([1.0, 0.0, 0.0])
+    candidates = np.array([
+        [0.9, 0.436, 0.0],
+        [0.9, 0.436, 0.0],
+        [0.8, 0.0, 0.6],
+    ])
+    assert list(mmr_select(query, candidates, 2, lambda_=1.0)) == [0, 1]
+    assert list(mmr_select(query, candidates, 2, lambda_=0.5)) == [0, 2]
+
+
+def test_rag_engine_mmr_diversifies_context():
+    """
+    With MMR on, build_context returns distinct passages first.
+    """
+    memory = VectorMemory(near_duplicate_distance=None)
+    for text in NEAR_DUPLICATE_DOCS:
+        memory.add(text, source="guide.md")
+
+    plain = RAGEngine(memory, top_k=2).build_context("run uvicorn server docs")
+    diverse = RAGEngine(memory, top_k=2, mmr_lambda=0.5).build_context("run uvicorn server docs")
+
+    assert NEAR_DUPLICATE_DOCS[3] not in plain[1]["content"]
+    assert NEAR_DUPLICATE_DOCS[3] in diverse[1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_rag_engine_mmr_runs_in_batch_thread():
+    """
+    On the batched path the MMR re-rank runs off the event loop and matches
+    the sync result.
+    """
+    memory = VectorMemory(near_duplicate_distance=None)
+    for text in NEAR_DUPLICATE_DOCS:
+        memory.add(text, source="guide.md")
+    engine = RAGEngine(
+        memory, top_k=2, batcher=QueryBatcher(memory, max_wait=0.001), mmr_lambda=0.5
+    )
+    threads = []
+    diversify = engine.diversify
+
+    def recording_diversify(query, docs):
+        threads.append(threading.get_ident())
+        return diversify(query, docs)
+
+    engine._rerank = recording_diversify
+    docs = await engine.aretrieve("run uvicorn server docs")
+
+    assert docs == RAGEngine(memory, top_k=2, mmr_lambda=0.5).retrieve("run uvicorn server docs")
+    assert threads and threading.get_ident() not in threads
+
+
+def test_synthetic_corpus_is_deterministic_and_labelled():
+    """
+    Chunks regenerate identically and every query comes from its label.
+    """
+    corpus = SyntheticCorpus(chunks=25_000, vocab_size=5000, topics=50)
+    again = SyntheticCorpus(chunks=25_000, vocab_size=5000, topics=50)
+    assert corpus.chunk(12_345) == again.chunk(12_345)
+    assert sum(len(block) for block in corpus.iter_blocks()) == 25_000
+
+    for query, label in corpus.queries(20):
+        assert set(query.split()) <= set(label.split())
+
+
+def test_benchmark_recall_counts_ties_at_the_cutoff():
+    """
+    A result scoring as high as the reference's last hit is not a miss.
+    """
+    scores = {"a": 3.0, "b": 2.0, "c": 2.0, "d": 1.0}
+    exact = lambda i, texts: np.array([scores[text] for text in texts])
+
+    tied = quality([["a", "c"]], [["a", "b"]], ["a"], 2, scores=exact)
+    assert tied["recall@2"] == 1.0
+    assert quality([["a", "c"]], [["a", "b"]], ["a"], 2)["recall@2"] == 0.5
+    assert quality([["a", "d"]], [["a", "b"]], ["a"], 2, scores=exact)["recall@2"] == 0.5
+
+
+def test_benchmark_reports_quality_latency_and_build():
+    """
+    A small benchmark run produces the machine-readable report.
+    """
+    corpus = SyntheticCorpus(chunks=2000, vocab_size=5000, topics=20)
+    report = run_benchmark(
+        corpus, ["memory", "store:flat:float32"], queries=20, k=5, threads=(1, 2)
+    )
+    json.dumps(report)
+
+    for name in ("memory", "store:flat:float32"):
+        entry = report["backends"][name]
+        # Exhaustive backends match their reference (same dedup, ties allowed)
+        assert entry["quality"]["recall@5"] == 1.0
+        assert entry["quality"]["label_hit@5"] >= 0.8
+        assert set(entry["latency"]) == {"1", "2"}
+        assert entry["latency"]["1"]["qps"] > 0
+        assert entry["build"]["build_seconds"] >= 0
+    assert report["backends"]["store:flat:float32"]["build"]["index_bytes"] == 2000 * 384 * 4
@@ -0,0 +1,265 @@
+"""Unit tests for resumable SSE streams."""
+import asyncio
+from contextlib import aclosing
+
+import pytest
+
+from src.agent import deepseek
+from src.core.streaming import (
+    ReplayBuffer,
+    StreamRegistry,
+    format_sse,
+    parse_last_event_id,
+    until_disconnected,
+)
+
+
+async def fake_agent(tokens, delay=0.0):
+    """Stand-in for stream_agent yielding a fixed token sequence."""
+    for token in tokens:
+        if delay:
+            await asyncio.sleep(delay)
+        yield {"type": "token", "data": token}
+    yield {"type": "done", "data": ""}
+
+
+async def collect(stream, after_seq=0, limit=None):
+    events = []
+    async with aclosing(stream.subscribe(after_seq)) as subscription:
+        async for event in subscription:
+            events.append(event)
+            if limit is not None and len(events) >= limit:
+                break
+    return events
+
+
+def test_parse_last_event_id():
+    """Event ids round-trip through the Last-Event-ID header."""
+    assert parse_last_event_id("abc123:7") == ("abc123", 7)
+    assert parse_last_event_id("7") is None
+    assert parse_last_event_id("abc:x") is None
+
+
+def test_replay_buffer_is_bounded():
+    """The ring buffer keeps only the newest events."""
+    buffer = ReplayBuffer(max_events=3)
+    for i in range(5):
+        buffer.append("token", str(i))
+
+    assert buffer.first_seq == 3
+    assert buffer.last_seq == 5
+    assert buffer.covers(2)
+    assert not buffer.covers(1)
+
+
+@pytest.mark.asyncio
+async def test_stream_produces_numbered_events():
+    """A full stream yields start, tokens and done with increasing ids."""
+    registry = StreamRegistry(max_events=100, max_bytes=1 << 20, grace_seconds=1.0)
+    completed = []
+
+    stream = registry.create("s1")
+    stream.start(fake_agent(["Hel", "lo"]), on_complete=completed.append)
+    events = await collect(stream)
+
+    assert [e.event for e in events] == ["start", "token", "token", "done"]
+    assert [e.seq for e in events] == [1, 2, 3, 4]
+    assert completed == ["Hello"]
+    assert format_sse(stream.stream_id, events[1]).startswith(f"id: {stream.stream_id}:2\n")
+
+
+@pytest.mark.asyncio
+async def test_resume_replays_without_new_generation():
+    """A reconnect resumes from the buffer while generation continued."""
+    registry = StreamRegistry(max_events=100, max_bytes=1 << 20, grace_seconds=5.0)
+    calls = []
+
+    async def counting_agent():
+        calls.append(1)
+        async for event in fake_agent(["a", "b", "c", "d"], delay=0.01):
+            yield event
+
+    stream = registry.create("s1")
+    stream.start(counting_agent(), on_complete=lambda text: None)
+
+    # Client drops after the first token
+    first = await collect(stream, limit=2)
+    last_id = f"{stream.stream_id}:{first[-1].seq}"
+    await asyncio.sleep(0.1)
+    assert stream.buffer.closed  # generation kept going while detached
+
+    resumed = registry.resume(last_id, session_id="s1")
+    assert resumed is not None
+    same_stream, after_seq = resumed
+    rest = await collect(same_stream, after_seq)
+
+    tokens = [e.data for e in first + rest if e.event == "token"]
+    assert tokens == ["a", "b", "c", "d"]
+    assert len(calls) == 1
+    assert registry.resume(last_id, session_id="other") is None
+
+
+@pytest.mark.asyncio
+async def test_grace_period_cancels_unattended_generation():
+    """Nobody reconnecting within the grace period cancels upstream."""
+    registry = StreamRegistry(max_events=100, max_bytes=1 << 20, grace_seconds=0.05)
+    completed = []
+
+    stream = registry.create("s1")
+    stream.start(fake_agent(["x"] * 1000, delay=0.01), on_complete=completed.append)
+    await collect(stream, limit=3)
+
+    await asyncio.sleep(0.2)
+    assert not stream.running
+    assert completed and len(completed[0]) < 1000
+
+
+@pytest.mark.asyncio
+async def test_savings_estimate_uses_mean_completed_length():
+    """Cancelled generations are measured against completed ones, not the budget."""
+    registry = StreamRegistry(max_events=100, max_bytes=1 << 20, grace_seconds=0.0)
+
+    finished = registry.create("s1")
+    finished.start(fake_agent(["x"] * 10), on_complete=lambda _: None, max_tokens=1000)
+    await collect(finished)
+
+    cancelled = registry.create("s2")
+    cancelled.start(
+        fake_agent(["x"] * 1000, delay=0.01), on_complete=lambda _: None, max_tokens=1000
+    )
+    await collect(cancelled, limit=4)  # start event + 3 tokens
+    await asyncio.sleep(0.05)
+
+    stats = registry.stats()
+    assert stats["completed"] == 1
+    assert stats["mean_completion_tokens"] == 10
+    assert stats["cancelled"] == 1
+    assert 0 < stats["tokens_saved"] <= 7
+    assert stats["max_tokens_avoided"] >= 990
+
+
+@pytest.mark.asyncio
+async def test_total_buffer_memory_is_capped():
+    """Finished streams are evicted to respect the global byte cap."""
+    registry = StreamRegistry(max_events=1000, max_bytes=2000, grace_seconds=60.0)
+
+    for i in range(5):
+        stream = registry.create(f"s{i}")
+        stream.start(fake_agent(["y" * 50] * 10), on_complete=lambda text: None)
+        await collect(stream)
+
+    assert registry.total_bytes <= 2000
+    assert registry.evicted_streams > 0
+    assert len(registry) < 5
+
+
+class FakeSlowUpstream:
+    """
+    Minimal OpenRouter stand-in that sends one token and then stalls.
+
+    Records when the client closes the connection so tests can measure how
+    quickly cancellation reaches the upstream socket.
+    """
+
+    def __init__(self):
+        self.closed_at = None
+        self.connected = asyncio.Event()
+        self._server = None
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
+
+    @property
+    def url(self):
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/chat/completions"
+
+    async def _handle(self, reader, writer):
+        headers = await reader.readuntil(b"\r\n\r\n")
+        length = 0
+        for line in headers.decode().split("\r\n"):
+            if line.lower().startswith("content-length:"):
+                length = int(line.split(":", 1)[1])
+        await reader.readexactly(length)
+
+        chunk = b'data: {"choices": [{"delta": {"content": "Hi"}}]}\n\n'
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+            + f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n"
+        )
+        await writer.drain()
+        self.connected.set()
+
+        # Stall until the client hangs up
+        await reader.read()
+        self.closed_at = asyncio.get_running_loop().time()
+        writer.close()
+
+
+class FakeRequest:
+    """Exposes the ASGI ``receive`` channel the disconnect watcher listens on."""
+
+    def __init__(self):
+        self.disconnect = asyncio.Event()
+
+    async def receive(self):
+        await self.disconnect.wait()
+        return {"type": "http.disconnect"}
+
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_stalled_upstream_promptly(monkeypatch):
+    """A disconnect closes a stalled upstream stream without waiting for a token."""
+    registry = StreamRegistry(max_events=100, max_bytes=1 << 20, grace_seconds=0.0)
+    completed = []
+
+    async with FakeSlowUpstream() as upstream:
+        monkeypatch.setattr(deepseek.settings, "api_url", upstream.url)
+
+        stream = registry.create("s1")
+        stream.start(
+            deepseek.stream_agent([{"role": "user", "content": "hi"}]),
+            on_complete=completed.append,
+            max_tokens=100,
+        )
+        request = FakeRequest()
+        received = []
+
+        async def client():
+            async with aclosing(stream.subscribe()) as events:
+                async for event in until_disconnected(events, request):
+                    received.append(event)
+
+        client_task = asyncio.create_task(client())
+        await asyncio.wait_for(upstream.connected.wait(), timeout=5)
+        while not any(e.event == "token" for e in received):
+            await asyncio.sleep(0.01)
+
+        loop = asyncio.get_running_loop()
+        disconnected_at = loop.time()
+        request.disconnect.set()
+        await asyncio.wait_for(client_task, timeout=1)
+
+        for _ in range(100):
+            if upstream.closed_at is not None:
+                break
+            await asyncio.sleep(0.01)
+
+    assert upstream.closed_at is not None
+    assert upstream.closed_at - disconnected_at < 0.5
+    assert not stream.running
+    assert completed == ["Hi"]
+
+    stats = registry.stats()
+    assert stats["cancelled"] == 1
+    assert stats["max_tokens_avoided"] == 99
+    # No generation has completed yet, so there is no measured length
+    assert stats["tokens_saved"] == 0
+    assert stats["max_cancel_latency_ms"] < 500